@@ -129,6 +129,9 @@ class App(QApplication):
     def newResultsPacket(self):
         self.window.ui.pageResults.newResultsPacket()
 
+    def downloadProgress(self, progress):
+        self.window.ui.pageResults.downloadProgress(progress)
+
     def newCalibration(self, calibration):
         self.window.ui.pageCalibration.newCalibration(calibration)
 
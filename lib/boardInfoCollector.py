@@ -14,8 +14,8 @@ class BoardInfoCollector(QObject):
         super().__init__()
         self.port = port
 
-        self.radioManager = RadioManager()
-        self.radioManager.newPacket.connect(self.newPacket)
+        self.radioManager = RadioManager(batchPackets=True)
+        self.radioManager.newPackets.connect(self.newPackets)
 
         self.errors = None
         self.versionInfo = None
@@ -23,6 +23,10 @@ class BoardInfoCollector(QObject):
     def connect(self):
         self.radioManager.run(self.port)
 
+    def newPackets(self, packets):
+        for packet in packets:
+            self.newPacket(packet)
+
     def newPacket(self, packet):
         self.resetDataAge.emit()
         if type(packet) is SetupPacket:
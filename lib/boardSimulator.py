@@ -0,0 +1,294 @@
+import argparse
+import math
+import os
+import random
+import select
+import time
+from enum import Enum
+from threading import Thread
+
+from .radio import RadioManager, FRAME_LAYOUT, MASK_8_BIT, MASK_16_BIT, MASK_24_BIT
+from .firing import PACKET_STRIDE
+from .firmwareVersions import ALLOWED_HARDWARE_REVISIONS, ALLOWED_FIRMWARE_VERSIONS
+from .motor import NUM_CAL_FRAMES
+from .logger import logger
+
+# Stand-in for an RMTS board, for exercising the radio and results code without hardware. It speaks the same protocol
+# as the board over anything with read(size, timeout) and write(data) methods, such as one end of a pty pair.
+
+class SIM_STATE(Enum):
+    IDLE = 1
+    FIRING = 2
+    RESULTS = 3
+    CALIBRATING = 4
+
+class PACKET_TYPES:
+    SETUP = 0
+    ERROR = 1
+    RESULT = 2
+    VERSION = 3
+    FIRING = 4
+    FIRE = 128
+    STOP = 129
+    CAL_START = 130
+    CAL_STOP = 131
+
+# Recordings are always a whole number of blocks of this many datapoints
+RECORDING_BLOCK = 64
+# How long a write waits for the app to read before the rest of what was being sent is dropped
+WRITE_TIMEOUT = 0.1
+# Raw reading of an unloaded transducer
+BASE_READING = 0x100000
+# Recordings are cut off after this many datapoints if a stop packet never arrives
+MAX_RECORDING_POINTS = 2 ** 16
+
+# Builds a complete frame to transmit, including the preamble, checksum, and escapes
+def encodeFrame(packetType, seqNum, payload):
+    body = bytearray(FRAME_LAYOUT.pack(packetType, 0, seqNum & MASK_16_BIT, payload))
+    body[1] = (256 - sum(body)) % 256
+    frame = bytearray(RadioManager.PREAMBLE)
+    for byte in body:
+        if byte in RadioManager.PREAMBLE or byte == RadioManager.ESCAPE:
+            frame.append(RadioManager.ESCAPE)
+        frame.append(byte)
+    return frame
+
+def pack24Bit(force, pressure):
+    return (force & MASK_24_BIT) | ((pressure & MASK_24_BIT) << 24)
+
+# Produces a recording of a simulated firing as lists of raw time (ms), force and pressure readings
+def generateRecording(numPoints, burnTime=1.5, peakForce=0x300000, peakPressure=0x200000, seed=None):
+    rand = random.Random(seed)
+    recording = {'time': [], 'force': [], 'pressure': []}
+    ignition = NUM_CAL_FRAMES * 7 + 250
+    currentTime = 0
+    for i in range(numPoints):
+        # The board takes 6 or 7 ms per datapoint
+        currentTime += rand.choice((6, 7))
+        burnFraction = (currentTime - ignition) / (burnTime * 1000)
+        level = math.sin(math.pi * burnFraction) ** 0.5 if 0 < burnFraction < 1 else 0
+        force = BASE_READING + int(level * peakForce + rand.gauss(0, 200))
+        pressure = BASE_READING + int(level * peakPressure + rand.gauss(0, 200))
+        recording['time'].append(currentTime)
+        recording['force'].append(min(max(force, 0), 0x7FFFFF))
+        recording['pressure'].append(min(max(pressure, 0), 0x7FFFFF))
+    return recording
+
+class PtyPort():
+    def __init__(self, fd):
+        self.fd = fd
+
+    def read(self, size, timeout):
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if len(ready) == 0:
+            return b''
+        try:
+            return os.read(self.fd, size)
+        except OSError:
+            # Linux reports EIO when nothing has the other end of the pty open
+            time.sleep(timeout)
+            return b''
+
+    def write(self, data):
+        view = memoryview(data)
+        while len(view) > 0:
+            try:
+                written = os.write(self.fd, view)
+            except BlockingIOError:
+                # If nothing is reading the other end, the rest is lost like it would be over the air
+                _, writable, _ = select.select([], [self.fd], [], WRITE_TIMEOUT)
+                if len(writable) == 0:
+                    return
+                continue
+            view = view[written:]
+
+    def close(self):
+        os.close(self.fd)
+
+# Opens a pty pair and returns the board's end of it, the device path the app should connect to, and a descriptor that
+# holds the app's end open while nothing is connected to it
+def openPty():
+    import tty # Only available on posix systems
+    boardFd, appFd = os.openpty()
+    tty.setraw(boardFd)
+    tty.setraw(appFd)
+    os.set_blocking(boardFd, False)
+    return PtyPort(boardFd), os.ttyname(appFd), appFd
+
+class SimulatedBoard():
+    def __init__(self, port, packetRate=60, lossRate=0, corruptionRate=0, seed=None):
+        self.port = port
+        self.packetRate = packetRate
+        self.lossRate = lossRate
+        self.corruptionRate = corruptionRate
+        self.random = random.Random(seed)
+        self.seed = seed
+
+        self.hardwareVersion = ALLOWED_HARDWARE_REVISIONS[-1]
+        self.firmwareVersion = ALLOWED_FIRMWARE_VERSIONS[-1]
+        self.continuity = True
+
+        self.state = SIM_STATE.IDLE
+        self.recording = None
+        self.recordingLength = 0
+        self.fireStart = None
+        self.fireDuration = 0
+        self.resultsOrder = []
+        self.resultsIndex = 0
+        self.packetCount = 0
+
+        self._commandBuffer = bytearray()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = Thread(target=self._run)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+
+    # Skips straight to sending back a recording, for testing downloads without going through a firing first
+    def startResults(self, numPoints):
+        numPoints = math.ceil(numPoints / RECORDING_BLOCK) * RECORDING_BLOCK
+        self.recording = generateRecording(numPoints, seed=self.seed)
+        self._beginResults(numPoints)
+
+    def _beginResults(self, numPoints):
+        logger.log('Simulated board sending {} results'.format(numPoints))
+        self.recordingLength = numPoints
+        # Results are sent in passes that each cover every PACKET_STRIDE'th datapoint, starting from a different offset
+        self.resultsOrder = [seqNum for offset in range(PACKET_STRIDE) for seqNum in range(offset, numPoints, PACKET_STRIDE)]
+        self.resultsIndex = 0
+        self.state = SIM_STATE.RESULTS
+
+    def _run(self):
+        interval = 1 / self.packetRate
+        nextSend = time.monotonic()
+        while self.running:
+            self._readCommands(max(0, nextSend - time.monotonic()))
+            now = time.monotonic()
+            if now < nextSend:
+                continue
+            # Packets that came due while we were busy are written out together
+            due = min(int((now - nextSend) / interval) + 1, max(int(self.packetRate), 1))
+            out = bytearray()
+            for i in range(due):
+                out += self._transmitFrame(self._nextFrame())
+            if len(out) > 0:
+                self.port.write(out)
+            nextSend = max(nextSend + due * interval, now - interval)
+
+    def _transmitFrame(self, frame):
+        if self.random.random() < self.lossRate:
+            return b''
+        if self.random.random() < self.corruptionRate:
+            frame[self.random.randrange(len(frame))] ^= 1 << self.random.randrange(8)
+        return frame
+
+    def _readCommands(self, timeout):
+        self._commandBuffer += self.port.read(256, timeout)
+        # Packets from the app aren't escaped, so look for a preamble followed by a full frame with a valid checksum
+        while True:
+            start = self._commandBuffer.find(bytes(RadioManager.PREAMBLE))
+            if start == -1:
+                del self._commandBuffer[:-1]
+                return
+            end = start + len(RadioManager.PREAMBLE) + RadioManager.PACKET_SIZE
+            if len(self._commandBuffer) < end:
+                del self._commandBuffer[:start]
+                return
+            body = self._commandBuffer[start + len(RadioManager.PREAMBLE):end]
+            if RadioManager.checkPacket(body):
+                self._handleCommand(body)
+                del self._commandBuffer[:end]
+            else:
+                del self._commandBuffer[:start + 1]
+
+    def _handleCommand(self, body):
+        packetType, _, _, payload = FRAME_LAYOUT.unpack(body)
+        if packetType == PACKET_TYPES.FIRE and self.state == SIM_STATE.IDLE:
+            self.fireDuration = (payload >> 16) & MASK_16_BIT
+            logger.log('Simulated board firing for {} ms'.format(self.fireDuration))
+            self.recording = generateRecording(MAX_RECORDING_POINTS, self.fireDuration / 1000, seed=self.seed)
+            self.fireStart = time.monotonic()
+            self.state = SIM_STATE.FIRING
+        elif packetType == PACKET_TYPES.STOP and self.state == SIM_STATE.FIRING:
+            elapsed = (time.monotonic() - self.fireStart) * 1000
+            recorded = sum(1 for t in self.recording['time'] if t <= elapsed)
+            numPoints = min(max(math.ceil(recorded / RECORDING_BLOCK), 1) * RECORDING_BLOCK, MAX_RECORDING_POINTS)
+            self._beginResults(numPoints)
+        elif packetType == PACKET_TYPES.CAL_START and self.state == SIM_STATE.IDLE:
+            logger.log('Simulated board calibrating')
+            self.state = SIM_STATE.CALIBRATING
+        elif packetType == PACKET_TYPES.CAL_STOP and self.state == SIM_STATE.CALIBRATING:
+            logger.log('Simulated board done calibrating')
+            self.state = SIM_STATE.IDLE
+
+    def _nextFrame(self):
+        self.packetCount += 1
+        # The version and errors are sent in every state, so an app that connects partway through a download can
+        # still check the version before it accepts results
+        if self.packetCount % 20 == 0:
+            return encodeFrame(PACKET_TYPES.VERSION, 0, self.firmwareVersion | (self.hardwareVersion << 16))
+        if self.packetCount % 20 == 10:
+            return encodeFrame(PACKET_TYPES.ERROR, 0, 0)
+        if self.state == SIM_STATE.RESULTS:
+            return self._resultFrame()
+        if self.state == SIM_STATE.FIRING:
+            return self._firingFrame()
+        return self._setupFrame()
+
+    def _setupFrame(self):
+        force = BASE_READING + int(self.random.gauss(0, 200))
+        pressure = BASE_READING + int(self.random.gauss(0, 200))
+        payload = pack24Bit(force, pressure) | (int(self.continuity) << 48)
+        return encodeFrame(PACKET_TYPES.SETUP, 0, payload)
+
+    def _firingFrame(self):
+        elapsed = int((time.monotonic() - self.fireStart) * 1000)
+        index = min(int(elapsed / 6.5), len(self.recording['time']) - 1)
+        force = self.recording['force'][index]
+        pressure = self.recording['pressure'][index]
+        continuity = self.continuity and elapsed < self.fireDuration
+        firingTime = elapsed & 0x7FFF
+        timeBytes = (firingTime & MASK_8_BIT) | (((firingTime >> 8) << 1) | int(continuity)) << 8
+        return encodeFrame(PACKET_TYPES.FIRING, 0, pack24Bit(force, pressure) | (timeBytes << 48))
+
+    def _resultFrame(self):
+        seqNum = self.resultsOrder[self.resultsIndex]
+        self.resultsIndex = (self.resultsIndex + 1) % len(self.resultsOrder)
+        recordedTime = self.recording['time'][seqNum] & MASK_16_BIT
+        force = self.recording['force'][seqNum]
+        pressure = self.recording['pressure'][seqNum]
+        payload = recordedTime | (force << 16) | (pressure << 40)
+        return encodeFrame(PACKET_TYPES.RESULT, seqNum, payload)
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate an RMTS board on a pty')
+    parser.add_argument('--rate', type=float, default=60, help='Packets sent per second')
+    parser.add_argument('--loss', type=float, default=0, help='Fraction of packets to drop')
+    parser.add_argument('--corruption', type=float, default=0, help='Fraction of packets to corrupt')
+    parser.add_argument('--results', type=int, default=None, help='Start out sending a recording this many points long')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the random number generator')
+    args = parser.parse_args()
+
+    port, path, appFd = openPty()
+    board = SimulatedBoard(port, args.rate, args.loss, args.corruption, args.seed)
+    if args.results is not None:
+        board.startResults(args.results)
+    print('Simulated board listening on {}'.format(path))
+    board.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        board.stop()
+        port.close()
+        os.close(appFd)
+
+if __name__ == '__main__':
+    main()
@@ -34,8 +34,8 @@ class Calibration(QObject):
         self.port = port
         self.filter = LowPass(5)
 
-        self.radioManager = RadioManager()
-        self.radioManager.newPacket.connect(self.newPacket)
+        self.radioManager = RadioManager(batchPackets=True)
+        self.radioManager.newPackets.connect(self.newPackets)
 
         self.points = []
         self.converter = Converter(baseConfig)
@@ -48,6 +48,10 @@ class Calibration(QObject):
         self.converter.setProperties(properties)
         self.newInfo.emit(properties)
 
+    def newPackets(self, packets):
+        for packet in packets:
+            self.newPacket(packet)
+
     def newPacket(self, packet):
         self.resetDataAge.emit()
         if type(packet) is SetupPacket:
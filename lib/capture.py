@@ -0,0 +1,65 @@
+import struct
+import time
+from enum import IntEnum
+from threading import Lock
+
+# Captures record every byte that goes over a radio link along with when it happened, so sessions can be replayed
+# through the decoder later. A capture file starts with CAPTURE_MAGIC and a header holding the format version and the
+# wall clock time the capture started. Then there is a record for each read or write: the seconds since the start, the
+# direction, and the length of the data, followed by the data itself.
+CAPTURE_MAGIC = b'RMTSCAP'
+CAPTURE_VERSION = 1
+HEADER_LAYOUT = struct.Struct('<Bd')
+RECORD_LAYOUT = struct.Struct('<dBI')
+
+class CAPTURE_DIRECTION(IntEnum):
+    RECEIVED = 0
+    SENT = 1
+
+def isCaptureFile(path):
+    with open(path, 'rb') as captureFile:
+        return captureFile.read(len(CAPTURE_MAGIC)) == CAPTURE_MAGIC
+
+class CaptureWriter():
+    def __init__(self, path):
+        self._lock = Lock()
+        self._file = open(path, 'wb')
+        self._startTime = time.monotonic()
+        self._file.write(CAPTURE_MAGIC + HEADER_LAYOUT.pack(CAPTURE_VERSION, time.time()))
+
+    def record(self, direction, data):
+        if len(data) == 0:
+            return
+        with self._lock:
+            self._file.write(RECORD_LAYOUT.pack(time.monotonic() - self._startTime, direction, len(data)))
+            self._file.write(data)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+class CaptureReader():
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        if self._file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            self._file.close()
+            raise ValueError('"{}" is not a capture file'.format(path))
+        self.version, self.startTime = HEADER_LAYOUT.unpack(self._file.read(HEADER_LAYOUT.size))
+        if self.version > CAPTURE_VERSION:
+            self._file.close()
+            raise ValueError('Capture file version {} is newer than this software supports'.format(self.version))
+
+    # Returns the next record as (time, direction, data), or None at the end of the file. A record cut short by the
+    # capture being interrupted counts as the end.
+    def readRecord(self):
+        header = self._file.read(RECORD_LAYOUT.size)
+        if len(header) < RECORD_LAYOUT.size:
+            return None
+        timestamp, direction, length = RECORD_LAYOUT.unpack(header)
+        data = self._file.read(length)
+        if len(data) < length:
+            return None
+        return timestamp, CAPTURE_DIRECTION(direction), data
+
+    def close(self):
+        self._file.close()
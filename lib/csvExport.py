@@ -0,0 +1,13 @@
+# How many rows are formatted before they are written out together
+CSV_CHUNK_ROWS = 4096
+
+# Writes a header and then a row for each set of values taken from the columns, to anything with a write method. Rows
+# are formatted with rowFormat and written a chunk at a time, so large files are never built up in memory. Like the
+# rest of the app's CSVs, rows are separated by newlines and the file doesn't end with one.
+def writeCSV(outFile, header, columns, rowFormat, chunkSize=CSV_CHUNK_ROWS):
+    outFile.write(','.join(header))
+    lineFormat = '\n' + rowFormat
+    numRows = min(len(column) for column in columns) if len(columns) > 0 else 0
+    for start in range(0, numRows, chunkSize):
+        chunk = [column[start:start + chunkSize] for column in columns]
+        outFile.write(''.join(map(lineFormat.format, *chunk)))
@@ -0,0 +1,136 @@
+from math import log, ceil
+from time import monotonic
+
+import numpy as np
+
+# How often progress is sent out while results are downloading
+PROGRESS_INTERVAL = 0.5
+
+# Tracks how a download of results is going and estimates how long it will take to finish. The board sends a recording
+# over and over in passes that each cover every stride'th datapoint, starting from offsets 0 through stride - 1, so
+# once the size of the recording is known, the position of each sequence number in that order tells how long it will
+# be until it comes around again. The rate the board moves through the order and the fraction of packets that make it
+# through are measured from the positions of the results that arrive.
+class DownloadProgress():
+    def __init__(self, results, stride):
+        self.results = results
+        self.stride = stride
+        self.startTime = monotonic()
+        self.unique = 0
+        self.duplicates = 0
+
+        # How far the board has moved through its order since the size was known, when that started, and where in the
+        # order the last new result was and when it arrived
+        self._advance = 0
+        self._lastPosition = None
+        self._lastResultTime = None
+        self._trackingStart = None
+        self._trackingSize = None
+        self._trackedResults = 0
+
+        self._lastSend = self.startTime
+        self._lastUnique = 0
+        self._lastTotal = 0
+
+    # Returns each sequence number's position in the order the board sends them in
+    def getPositions(self, seqNums):
+        size = self.results.size
+        passLengths = [ceil((size - offset) / self.stride) for offset in range(self.stride)]
+        passStarts = np.concatenate(([0], np.cumsum(passLengths)[:-1]))
+        seqNums = np.asarray(seqNums)
+        return passStarts[seqNums % self.stride] + seqNums // self.stride
+
+    def addResult(self, seqNum):
+        self.unique += 1
+        size = self.results.size
+        if size is None or seqNum >= size:
+            return
+        if self._trackingSize != size:
+            self._trackingSize = size
+            self._trackingStart = monotonic()
+            self._advance = 0
+            self._trackedResults = 0
+            self._lastPosition = None
+        position = int(self.getPositions(seqNum))
+        if self._lastPosition is not None:
+            self._advance += (position - self._lastPosition) % size
+            self._trackedResults += 1
+        self._lastPosition = position
+        self._lastResultTime = monotonic()
+
+    def addDuplicates(self, count):
+        self.duplicates += count
+        if self._trackingStart is not None:
+            self._trackedResults += count
+
+    def isDue(self):
+        return monotonic() - self._lastSend >= PROGRESS_INTERVAL
+
+    def getDuplicateRatio(self):
+        total = self.unique + self.duplicates
+        if total == 0:
+            return 0
+        return self.duplicates / total
+
+    # Returns the number of results the board sends each second, including ones that are lost, or None if unknown. A
+    # batch of results can all arrive at the same time as far as a coarse clock can tell, so no time passing is unknown.
+    def getSendRate(self):
+        elapsed = self._lastResultTime - self._trackingStart if self._trackingStart is not None else 0
+        if self._advance == 0 or elapsed <= 0:
+            return None
+        return self._advance / elapsed
+
+    # Near the end of a download new results are rare, so how far the board has moved on since the last one is
+    # estimated from the time that has passed
+    def _getAdvanceSinceResult(self):
+        return self.getSendRate() * (monotonic() - self._lastResultTime)
+
+    # Returns the fraction of the packets the board sent that were received, or None until it can be measured
+    def getDeliveryRatio(self):
+        if self.getSendRate() is None:
+            return None
+        return min(self._trackedResults / (self._advance + self._getAdvanceSinceResult()), 1)
+
+    # Returns the estimated number of seconds until every result has been received, or None if it can't be estimated
+    def getTimeRemaining(self, missing):
+        if len(missing) == 0:
+            return 0
+        sendRate = self.getSendRate()
+        delivered = self.getDeliveryRatio()
+        if sendRate is None or delivered is None or delivered == 0:
+            return None
+        size = self.results.size
+        # Every missing result will have been sent again once the furthest one in the order comes around
+        position = self._lastPosition + self._getAdvanceSinceResult()
+        untilSent = ((self.getPositions(missing) - position) % size).max()
+        # Some of them will be lost again, and each full pass after that recovers the same fraction of the rest. This is
+        # about how many passes it takes until the last of them arrives.
+        lost = len(missing) * (1 - delivered)
+        extraCycles = 0
+        if delivered < 1:
+            extraCycles = log(1 + lost) / -log(1 - delivered)
+        return (untilSent + extraCycles * size) / sendRate
+
+    def snapshot(self):
+        now = monotonic()
+        elapsed = now - self._lastSend
+        total = self.unique + self.duplicates
+        missing = self.results.getMissing() if self.results.size is not None else None
+        out = {
+            'duration': now - self.startTime,
+            'received': len(self.results),
+            'size': self.results.size,
+            'missing': None if missing is None else len(missing),
+            'gaps': self.results.getGaps(),
+            'uniqueResults': self.unique,
+            'duplicateResults': self.duplicates,
+            'duplicateRatio': self.getDuplicateRatio(),
+            'deliveryRatio': self.getDeliveryRatio(),
+            'uniquePerSecond': (self.unique - self._lastUnique) / elapsed if elapsed > 0 else 0,
+            'resultsPerSecond': (total - self._lastTotal) / elapsed if elapsed > 0 else 0,
+            'timeRemaining': None if missing is None else self.getTimeRemaining(missing)
+        }
+        self._lastSend = now
+        self._lastUnique = self.unique
+        self._lastTotal = total
+        return out
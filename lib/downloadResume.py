@@ -0,0 +1,54 @@
+from .firingJournal import getJournalPaths, JournalReader
+from .logger import logger
+
+# How many of the newest journals with results from the same board version are checked for a download to resume
+RESUME_CANDIDATES = 5
+# How many results have to be exactly the same as a journal's before they are taken to be from the same recording
+RESUME_MATCHES = 32
+
+class ResumeCandidate():
+    def __init__(self, path, results, size):
+        self.path = path
+        self.results = results
+        self.size = size
+        self.matches = 0
+
+# Finds results received earlier from the same recording, so a download that was cut short by the link or the app going
+# down doesn't have to start over. Journals of recent downloads from a board with the same version are candidates, and
+# incoming results are checked against them. Once enough match one exactly, check() returns it so its results can be
+# used, and any that don't match are dropped.
+class DownloadResume():
+    def __init__(self, firmwareVersion, hardwareVersion, excludePath=None):
+        self.candidates = []
+        for path in getJournalPaths()[::-1]:
+            if len(self.candidates) == RESUME_CANDIDATES:
+                break
+            if path == excludePath:
+                continue
+            try:
+                journal = JournalReader(path)
+            except Exception as err:
+                logger.warn('Could not read firing journal ({}). Error: {}'.format(path, repr(err)))
+                continue
+            if journal.getVersion() != (firmwareVersion, hardwareVersion):
+                continue
+            results = journal.getResults()
+            if len(results) > 0:
+                self.candidates.append(ResumeCandidate(path, results, journal.getSize()))
+
+    def isActive(self):
+        return len(self.candidates) > 0
+
+    def check(self, seqNum, time, force, pressure):
+        for candidate in self.candidates[:]:
+            results = candidate.results
+            if seqNum not in results:
+                continue
+            if (results.time[seqNum], results.force[seqNum], results.pressure[seqNum]) != (time, force, pressure):
+                self.candidates.remove(candidate)
+                continue
+            candidate.matches += 1
+            if candidate.matches >= RESUME_MATCHES:
+                self.candidates = []
+                return candidate
+        return None
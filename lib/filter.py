@@ -1,3 +1,6 @@
+import numpy as np
+from scipy.ndimage import median_filter
+
 class LowPass():
     def __init__(self, historyLength):
         self.maxSize = historyLength
@@ -13,3 +16,26 @@ class LowPass():
         if len(self._buffer) == 0:
             return None
         return sum(self._buffer) / len(self._buffer)
+
+# Windows are centered on each reading, so even window sizes are rounded up to give them a center
+def getWindowSize(window):
+    return 2 * (window // 2) + 1
+
+# Replaces every reading with the median of the ones around it, repeating the first and last readings to fill the
+# windows at the ends
+def rollingMedian(readings, window):
+    return median_filter(np.asarray(readings, dtype=np.float64), size=getWindowSize(window), mode='nearest')
+
+# Replaces the readings that are more than threshold standard deviations from the median of the ones around them with
+# that median, using the median absolute deviation to estimate the standard deviation so spikes don't inflate it
+def hampelFilter(readings, window, threshold):
+    readings = np.asarray(readings, dtype=np.float64)
+    if len(readings) == 0:
+        return readings
+    size = getWindowSize(window)
+    medians = rollingMedian(readings, size)
+    # Each window's deviations are from its own median, so the windows are built out to calculate them
+    windows = np.lib.stride_tricks.sliding_window_view(np.pad(readings, size // 2, mode='edge'), size)
+    absoluteDeviations = np.partition(np.abs(windows - medians[:, np.newaxis]), size // 2, axis=1)[:, size // 2]
+    deviations = 1.4826 * absoluteDeviations
+    return np.where(np.abs(readings - medians) > threshold * deviations, medians, readings)
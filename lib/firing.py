@@ -1,15 +1,19 @@
 from enum import Enum
 from math import ceil
 from threading import Thread
-from time import sleep
+from time import sleep, monotonic
 
 from PyQt6.QtCore import QObject, pyqtSignal
 
-from pyFileIO import fileIO
-
 from .converter import Converter
 from .radio import RadioManager, SetupPacket, FirePacket, ResultPacket, ErrorPacket, StopPacket, VersionPacket, FiringPacket
-from .motor import processRawData
+from .motor import IncrementalProcessor
+from .resultStore import ResultStore
+from .processingWorker import ProcessingWorker
+from .refreshPolicy import RefreshPolicy
+from .firingJournal import openJournal, JOURNAL_RECORD, JOURNAL_SYNC
+from .downloadResume import DownloadResume
+from .downloadProgress import DownloadProgress
 from .firmwareVersions import checkVersionPacket
 from .logger import logger
 
@@ -29,65 +33,82 @@ class Firing(QObject):
 
     fullSizeKnown = pyqtSignal(int)
     newResultsPacket = pyqtSignal()
+    downloadProgress = pyqtSignal(dict)
     initialResultsTime = pyqtSignal(float)
 
     fired = pyqtSignal()
     stopped = pyqtSignal()
     hasResults = pyqtSignal()
 
-    def __init__(self, forceConverter, pressureConverter, motorInfo, port):
+    def __init__(self, forceConverter, pressureConverter, motorInfo, port, refreshPolicy=None,
+            journalSync=JOURNAL_SYNC.ON_FLUSH):
         super().__init__()
         self.versionChecked = VERSION_CHECK_STATE.UNCHECKED
         self._exiting = False
 
         self.lastFiringPacket = None
-        self.firingPackets = []
 
-        self.rawData = {}
+        self.results = ResultStore()
+        self.progress = DownloadProgress(self.results, PACKET_STRIDE)
         self.startIndex = None
         self.lastSend = 0
-        self.lastSequenceMod = None
+        self.refreshPolicy = refreshPolicy if refreshPolicy is not None else RefreshPolicy()
         self.fullSize = None
+        self.resume = None
         self.firing = False
         self.onResultsView = False
 
         self.forceConverter = forceConverter
         self.pressureConverter = pressureConverter
         self.motorInfo = motorInfo
+        # Results are processed on the worker's thread, which has its own copy of them
+        processor = IncrementalProcessor(ResultStore(), forceConverter, pressureConverter, motorInfo)
+        self.processingWorker = ProcessingWorker(processor)
+        self.processingWorker.newResults.connect(self.newGraph.emit)
+
+        self.radioManager = RadioManager(batchPackets=True, logStats=True, suppressDuplicateResults=True)
+        self.radioManager.newPackets.connect(self.newPackets)
+        self.radioManager.duplicateResults.connect(self.duplicateResults)
+        # Everything received is journaled as it comes in, so it can be recovered if the app crashes. journalSync picks
+        # when the journal is forced onto the disk. The journal isn't opened until there is something to put in it, so
+        # connections that never hear from a board don't push older journals out of the backups.
+        self.journal = None
+        self.journalSync = journalSync
+        self._journalFailed = False
 
-        self.radioManager = RadioManager()
-        self.radioManager.newPacket.connect(self.newPacket)
         self.radioManager.run(port)
 
-        Thread(target=self._backupThread).start()
-
     def processAndSend(self):
-        logger.log('Processing more data ({}->{})'.format(self.lastSend, len(self.rawData)))
-        raw = {'time': [], 'force': [], 'pressure': []}
-
-        recv = list(self.rawData.keys())
-        recv.sort()
-        for i in recv:
-            raw['time'].append(self.rawData[i].time)
-            raw['force'].append(self.rawData[i].force)
-            raw['pressure'].append(self.rawData[i].pressure)
-
-        # Adjust for 16 bit time rolling over. This logic is duplicated from motorDataWidget.py
-        minTime = 0
-        for i, time in enumerate(raw['time']):
-            if i > 0 and time + minTime < raw['time'][i - 1]:
-                minTime += 2 ** 16
-            raw['time'][i] = time + minTime
-
-        self.lastSend = len(self.rawData)
+        logger.log('Processing more data ({}->{})'.format(self.lastSend, len(self.results)))
+        self.lastSend = len(self.results)
+        self.refreshPolicy.refreshed()
+        self.processingWorker.request()
+
+    def newPackets(self, packets):
+        for packet in packets:
+            self.newPacket(packet)
+        self.sendProgress()
+
+    # Repeats of results we already have aren't delivered, but they still show that the link is alive
+    def duplicateResults(self, count):
+        if self.versionChecked == VERSION_CHECK_STATE.SUCCESS:
+            self.newResultsPacket.emit()
+            self.progress.addDuplicates(count)
+            self.sendProgress()
 
-        self.newGraph.emit(processRawData(raw, self.forceConverter, self.pressureConverter, self.motorInfo))
+    def sendProgress(self, force=False):
+        if len(self.results) > 0 and (force or self.progress.isDue()):
+            self.downloadProgress.emit(self.progress.snapshot())
 
     def newPacket(self, packet):
         if type(packet) is VersionPacket and self.versionChecked == VERSION_CHECK_STATE.UNCHECKED:
             if checkVersionPacket(packet):
                 logger.log('Board version check passed ({})'.format(packet))
                 self.versionChecked = VERSION_CHECK_STATE.SUCCESS
+                # Any results that arrived before this were dropped, so they need to be delivered again
+                self.radioManager.forgetResults()
+                self.journalRecord(JOURNAL_RECORD.VERSION, 0, 0, packet.firmwareVersion, packet.hardwareVersion)
+                self.findResume(packet)
             else:
                 logger.error('Board version check failed ({})'.format(packet))
                 self.versionChecked = VERSION_CHECK_STATE.FAILURE
@@ -103,38 +124,82 @@ class Firing(QObject):
             self.newFiringPacket.emit(packet)
             if self.lastFiringPacket is None or packet.time != self.lastFiringPacket.time:
                 self.lastFiringPacket = packet
-                self.firingPackets.append(packet)
+                self.journalRecord(JOURNAL_RECORD.FIRING, packet.seqNum, packet.time, packet.force, packet.pressure)
         elif type(packet) is ResultPacket:
             self.newResultsPacket.emit()
             if not packet.validate():
                 logger.warn('Invalid results packet, {}'.format(packet))
                 return
-            self.rawData[packet.seqNum] = packet
-            if len(self.rawData) == 1:
+            if self.results.add(packet.seqNum, packet.time, packet.force, packet.pressure):
+                self.processingWorker.add(packet.seqNum, packet.time, packet.force, packet.pressure)
+                self.progress.addResult(packet.seqNum)
+                self.journalRecord(JOURNAL_RECORD.RESULT, packet.seqNum, packet.time, packet.force, packet.pressure)
+                if self.resume is not None:
+                    self.checkResume(packet)
+            if len(self.results) == 1:
                 logger.log('Got first result packet, setting start index to {}'.format(packet.seqNum))
                 self.startIndex = packet.seqNum
             else:
                 if self.lastSend == 0:
-                    self.initialResultsTime.emit(len(self.rawData) / 15)
+                    self.initialResultsTime.emit(len(self.results) / 15)
                     if abs(packet.seqNum - self.startIndex) < PACKET_STRIDE:
                         logger.log('Latest seq num ({}) close to start index ({})'.format(packet.seqNum, self.startIndex))
                         # The number of datapoints in a recording is always a multiple of 64 so we can figure out the
                         # size of the recording from the partial data assuming we got one of the last 64 datapoints.
                         # If not, it isn't a big deal because only the progress bar is impacted.
-                        self.fullSize = ceil(max(self.rawData.keys()) / 64) * 64
-                        self.fullSizeKnown.emit(self.fullSize)
-                        self.lastSequenceMod = packet.seqNum % PACKET_STRIDE
-                        self.processAndSend()
-                        self.onResultsView = True
+                        self.setFullSize(ceil(self.results.highest / 64) * 64)
 
-                diffSeqMod = self.lastSequenceMod is not None and packet.seqNum % PACKET_STRIDE != self.lastSequenceMod
-                if diffSeqMod and len(self.rawData) > self.lastSend and self.motorInfo is not None:
-                    self.lastSequenceMod = packet.seqNum % PACKET_STRIDE
-                    self.processAndSend()
+                elif self.motorInfo is not None:
+                    newPoints = len(self.results) - self.lastSend
+                    complete = self.results.isComplete()
+                    if self.refreshPolicy.shouldRefresh(newPoints, self.processingWorker.processingTime, complete):
+                        self.processAndSend()
                     if self.lastSend == self.fullSize:
-                        logger.log('Done receiving data')
+                        logger.log('Done receiving data in {:.1f} s ({:.0%} duplicates)'.format(
+                            monotonic() - self.progress.startTime, self.progress.getDuplicateRatio()))
+                        self.sendProgress(True)
                         self.radioManager.stop()
 
+    def setFullSize(self, size):
+        self.fullSize = size
+        self.results.setSize(size)
+        self.journalRecord(JOURNAL_RECORD.SIZE, 0, 0, size, 0)
+        self.fullSizeKnown.emit(size)
+        self.processAndSend()
+        self.onResultsView = True
+
+    # Looks for results from an earlier download that was cut short, in case this board is sending the same recording
+    def findResume(self, versionPacket):
+        journalPath = self.journal.path if self.journal is not None else None
+        try:
+            resume = DownloadResume(versionPacket.firmwareVersion, versionPacket.hardwareVersion, journalPath)
+        except Exception as err:
+            logger.error('Failed to look for a download to resume. Error: {}'.format(repr(err)))
+            return
+        if resume.isActive():
+            logger.log('Found {} earlier downloads that could be resumed'.format(len(resume.candidates)))
+            self.resume = resume
+
+    def checkResume(self, packet):
+        candidate = self.resume.check(packet.seqNum, packet.time, packet.force, packet.pressure)
+        if not self.resume.isActive():
+            self.resume = None
+        if candidate is None:
+            return
+        logger.log('Resuming download with {} results from ({})'.format(len(candidate.results), candidate.path))
+        results = candidate.results
+        seqNums = results.getSeqNums().tolist()
+        for seqNum in seqNums:
+            time, force, pressure = int(results.time[seqNum]), int(results.force[seqNum]), int(results.pressure[seqNum])
+            if self.results.add(seqNum, time, force, pressure):
+                self.processingWorker.add(seqNum, time, force, pressure)
+                self.journalRecord(JOURNAL_RECORD.RESULT, seqNum, time, force, pressure)
+        # The radio can drop repeats of these before they are built, like the ones it has received itself
+        self.radioManager.markResultsSeen(seqNums)
+        if candidate.size is not None and self.fullSize is None:
+            logger.log('Size of resumed download is {}'.format(candidate.size))
+            self.setFullSize(candidate.size)
+
     def fire(self):
         if not self.versionChecked:
             # This method should never be called if a version check hasn't passed, but just in case...
@@ -169,26 +234,20 @@ class Firing(QObject):
         self.radioManager.clearSendBuffer()
         self.stopped.emit()
 
-    def _backupThread(self):
-        dataLine = '\nT:{},F:{},P:{}'
-        backupFilePath = '{}/{}'.format(fileIO.getDataDirectory(), 'firings.bak')
-        try:
-            with open(backupFilePath, 'a') as backupFile:
-                backupFile.write('\n{} Firing {}'.format('#' * 30, '#' * 30))
-                backupFile.write('\nMotor info: {}'.format(self.motorInfo.getProperties()))
-                forceProps = self.forceConverter.getProperties() if self.forceConverter is not None else None
-                backupFile.write('\nLoad Cell: {}'.format(forceProps))
-                pressProps = self.pressureConverter.getProperties() if self.pressureConverter is not None else None
-                backupFile.write('\nPressure Transducer: {}'.format(pressProps))
-                backupFile.write('\nData:')
-                while not self._exiting:
-                    sleep(0.05)
-                    while len(self.firingPackets) > 0:
-                        packet = self.firingPackets.pop(0)
-                        backupFile.write(dataLine.format(packet.time, packet.force, packet.pressure))
-        except:
-            logger.error('Failed to open firing data backup file at ({})'.format(backupFilePath))
+    def journalRecord(self, kind, seqNum, time, force, pressure):
+        if self.journal is None and not self._journalFailed and not self._exiting:
+            try:
+                self.journal = openJournal(self.motorInfo, self.forceConverter, self.pressureConverter, self.journalSync)
+            except Exception as err:
+                logger.error('Failed to open firing journal. Error: {}'.format(repr(err)))
+                self._journalFailed = True
+        if self.journal is not None:
+            self.journal.record(kind, seqNum, time, force, pressure)
 
     def exit(self):
         self._exiting = True
         self.radioManager.stop()
+        self.processingWorker.stop()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
@@ -0,0 +1,224 @@
+import argparse
+import os
+import struct
+import time
+from datetime import datetime
+from enum import Enum, IntEnum
+from threading import Thread, Lock, Event
+from traceback import format_exc
+
+import yaml
+
+from pyFileIO import fileIO
+
+from .fileTypes import FILE_TYPES
+from .resultStore import ResultStore
+from .timeUnwrap import unwrapTime
+from .logger import logger
+
+# Journals keep a copy of everything received while firing or downloading results, so a crash doesn't lose the data.
+# A journal starts with JOURNAL_MAGIC and a header holding the format version, the wall clock time the session started
+# and the length of the session info that follows it. The session info is YAML holding the motor info and converters.
+# Then there is a fixed size record for each datapoint: what kind of packet it came from, its sequence number, and the
+# raw time, force and pressure readings. The board's version and the size of the recording, once they are known, are
+# stored in records of their own kinds, in the force and pressure fields.
+JOURNAL_MAGIC = b'RMTSJRN'
+JOURNAL_VERSION = 1
+JOURNAL_EXTENSION = 'rmtsj'
+HEADER_LAYOUT = struct.Struct('<BdI')
+RECORD_LAYOUT = struct.Struct('<BHHII')
+# Only this many of the newest journals are kept in the backup directory
+JOURNAL_RETENTION = 50
+BACKUP_DIRECTORY = 'backups'
+
+class JOURNAL_RECORD(IntEnum):
+    FIRING = 0
+    RESULT = 1
+    VERSION = 2
+    SIZE = 3
+
+# When the journal asks the OS to put data on the disk. NEVER still hands data to the OS every flush, so it survives the
+# app crashing but not the computer losing power. ON_FLUSH survives either, losing at most one flush interval of data.
+class JOURNAL_SYNC(Enum):
+    NEVER = 1
+    ON_CLOSE = 2
+    ON_FLUSH = 3
+
+def getBackupDirectory():
+    return '{}/{}'.format(fileIO.getDataDirectory(), BACKUP_DIRECTORY)
+
+# Returns the paths of the journals in the backup directory, oldest first
+def getJournalPaths():
+    directory = getBackupDirectory()
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(name for name in os.listdir(directory) if name.endswith('.' + JOURNAL_EXTENSION))
+    return ['{}/{}'.format(directory, name) for name in names]
+
+def pruneJournals(retention=JOURNAL_RETENTION):
+    journals = getJournalPaths()
+    for path in journals[:max(len(journals) - retention, 0)]:
+        try:
+            os.remove(path)
+        except OSError as err:
+            logger.warn('Could not remove old firing journal ({}). Error: {}'.format(path, repr(err)))
+
+def getSessionInfo(motorInfo, forceConverter, pressureConverter):
+    return {
+        'motorInfo': None if motorInfo is None else motorInfo.getProperties(),
+        'forceConv': None if forceConverter is None else forceConverter.getProperties(),
+        'pressureConv': None if pressureConverter is None else pressureConverter.getProperties()
+    }
+
+# Starts a journal for a new session in the backup directory, making room for it by removing the oldest ones
+def openJournal(motorInfo, forceConverter, pressureConverter, sync=JOURNAL_SYNC.ON_FLUSH):
+    os.makedirs(getBackupDirectory(), exist_ok=True)
+    pruneJournals(JOURNAL_RETENTION - 1)
+    name = 'firing-{}.{}'.format(datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f'), JOURNAL_EXTENSION)
+    path = '{}/{}'.format(getBackupDirectory(), name)
+    return JournalWriter(path, getSessionInfo(motorInfo, forceConverter, pressureConverter), sync=sync)
+
+# Writes are buffered in memory and flushed to the file every flushInterval seconds by a background thread, so recording
+# a datapoint is cheap enough to do for every packet on the thread that receives them.
+class JournalWriter():
+    def __init__(self, path, sessionInfo, flushInterval=0.5, sync=JOURNAL_SYNC.ON_FLUSH):
+        self.path = path
+        self.flushInterval = flushInterval
+        self.sync = sync
+        self._lock = Lock()
+        self._closed = Event()
+        self._file = open(path, 'wb')
+        info = yaml.safe_dump(sessionInfo).encode('utf-8')
+        self._file.write(JOURNAL_MAGIC + HEADER_LAYOUT.pack(JOURNAL_VERSION, time.time(), len(info)) + info)
+        self._thread = Thread(target=self._flushThread)
+        self._thread.start()
+
+    def record(self, kind, seqNum, time, force, pressure):
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(RECORD_LAYOUT.pack(kind, seqNum, time, force, pressure))
+
+    def close(self):
+        self._closed.set()
+        self._thread.join()
+        with self._lock:
+            self._file.flush()
+            if self.sync != JOURNAL_SYNC.NEVER:
+                os.fsync(self._file.fileno())
+            self._file.close()
+
+    def _flushThread(self):
+        while not self._closed.wait(self.flushInterval):
+            try:
+                with self._lock:
+                    self._file.flush()
+                # Syncing can take a while, so it is done without holding up new records
+                if self.sync == JOURNAL_SYNC.ON_FLUSH:
+                    os.fsync(self._file.fileno())
+            except Exception:
+                logger.error('Failed to write firing journal ({}). Error: {}'.format(self.path, format_exc()))
+
+class JournalReader():
+    def __init__(self, path):
+        with open(path, 'rb') as journalFile:
+            data = journalFile.read()
+        if not data.startswith(JOURNAL_MAGIC):
+            raise ValueError('"{}" is not a firing journal'.format(path))
+        offset = len(JOURNAL_MAGIC)
+        self.version, self.startTime, infoLength = HEADER_LAYOUT.unpack_from(data, offset)
+        if self.version > JOURNAL_VERSION:
+            raise ValueError('Firing journal version {} is newer than this software supports'.format(self.version))
+        offset += HEADER_LAYOUT.size
+        self.sessionInfo = yaml.safe_load(data[offset:offset + infoLength].decode('utf-8'))
+        offset += infoLength
+        # A record cut short by a crash is left off
+        end = offset + (len(data) - offset) // RECORD_LAYOUT.size * RECORD_LAYOUT.size
+        self.records = list(RECORD_LAYOUT.iter_unpack(data[offset:end]))
+
+    # Returns the board's (firmware version, hardware version), or None if the journal doesn't have them
+    def getVersion(self):
+        for kind, seqNum, time, force, pressure in self.records:
+            if kind == JOURNAL_RECORD.VERSION:
+                return force, pressure
+        return None
+
+    # Returns the size of the recording that was being downloaded, or None if it wasn't known
+    def getSize(self):
+        for kind, seqNum, time, force, pressure in self.records:
+            if kind == JOURNAL_RECORD.SIZE:
+                return force
+        return None
+
+    def getResults(self):
+        results = ResultStore()
+        for kind, seqNum, time, force, pressure in self.records:
+            if kind == JOURNAL_RECORD.RESULT:
+                results.add(seqNum, time, force, pressure)
+        return results
+
+    # Returns the raw data from the journal, in the form stored in .fire files. Downloaded results are used if there are
+    # any, since they are the full recording, and otherwise the data sent live during the firing is used. Like every
+    # other .fire file, the times of the results have their 16 bit rollovers undone.
+    def getRawData(self):
+        results = {}
+        for kind, seqNum, time, force, pressure in self.records:
+            if kind == JOURNAL_RECORD.RESULT and seqNum not in results:
+                results[seqNum] = (time, force, pressure)
+        if len(results) > 0:
+            datapoints = [results[seqNum] for seqNum in sorted(results)]
+            times = unwrapTime([datapoint[0] for datapoint in datapoints]).tolist()
+            datapoints = [(time,) + datapoint[1:] for time, datapoint in zip(times, datapoints)]
+        else:
+            datapoints = []
+            for kind, seqNum, time, force, pressure in self.records:
+                # The board repeats firing packets, so only the first one for each time is kept
+                if kind == JOURNAL_RECORD.FIRING and (len(datapoints) == 0 or time != datapoints[-1][0]):
+                    datapoints.append((time, force, pressure))
+        return {
+            'time': [datapoint[0] for datapoint in datapoints],
+            'force': [datapoint[1] for datapoint in datapoints],
+            'pressure': [datapoint[2] for datapoint in datapoints]
+        }
+
+    # Returns the contents of a .fire file holding the data in the journal
+    def toDictionary(self):
+        return {
+            'rawData': self.getRawData(),
+            'motorInfo': self.sessionInfo['motorInfo'],
+            'forceConv': self.sessionInfo['forceConv'],
+            'pressureConv': self.sessionInfo['pressureConv']
+        }
+
+def main():
+    from app import App
+
+    parser = argparse.ArgumentParser(description='Recover a firing from an RMTS firing journal')
+    parser.add_argument('journal', nargs='?', default=None, help='Journal to recover, defaults to the newest one')
+    parser.add_argument('output', nargs='?', default=None, help='Path of the .fire file to write')
+    parser.add_argument('--list', action='store_true', help='List the journals in the backup directory')
+    args = parser.parse_args()
+
+    fileIO.setAppInfo(App.NAME, App.VERSION)
+    fileIO.registerFileType(FILE_TYPES.FIRING)
+
+    if args.list:
+        for path in getJournalPaths():
+            print(path)
+        return
+    journalPath = args.journal
+    if journalPath is None:
+        journals = getJournalPaths()
+        if len(journals) == 0:
+            print('No journals found in {}'.format(getBackupDirectory()))
+            return
+        journalPath = journals[-1]
+    outputPath = args.output
+    if outputPath is None:
+        outputPath = os.path.splitext(os.path.basename(journalPath))[0] + '.fire'
+
+    journal = JournalReader(journalPath)
+    fileIO.save(FILE_TYPES.FIRING, journal.toDictionary(), outputPath)
+    print('Recovered {} datapoints from {} to {}'.format(len(journal.getRawData()['time']), journalPath, outputPath))
+
+if __name__ == '__main__':
+    main()
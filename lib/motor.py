@@ -1,7 +1,17 @@
+import io
 import math
 
-from pyFormGen.properties import PropertyCollection, FloatProperty, EnumProperty
+import numpy as np
+
+from pyFormGen.properties import PropertyCollection, FloatProperty, IntProperty, EnumProperty
 from .logger import logger
+from .filter import rollingMedian, hampelFilter
+from .csvExport import writeCSV
+from .timeUnwrap import unwrapNext
+
+DESPIKE_METHODS = ['Neighbor Ratio', 'Rolling Median', 'Hampel']
+# The headers of the columns that processed data can be exported with
+CSV_COLUMNS = {'time': 'time(s)', 'force': 'force(N)', 'pressure': 'pressure(Pa)'}
 
 class MotorConfig(PropertyCollection):
     def __init__(self, propDict=None):
@@ -10,6 +20,13 @@ class MotorConfig(PropertyCollection):
         self.props['propellantMass'] = FloatProperty('Propellant Mass', 'kg', 0.01, 100)
         self.props['throatDiameter'] = FloatProperty('Throat Diameter', 'm', 0.0001, 1)
         self.props['cutoffThreshold'] = FloatProperty('Cutoff', '%', 0.1, 99.9)
+        # How spikes are removed from the raw readings. The window is a number of datapoints and the threshold is only
+        # used by the Hampel filter, as a number of standard deviations.
+        self.props['despikeMethod'] = EnumProperty('Spike Filter', DESPIKE_METHODS)
+        self.props['despikeWindow'] = IntProperty('Spike Filter Window', '', 3, 101)
+        self.props['despikeThreshold'] = FloatProperty('Spike Filter Threshold', '', 0.5, 10)
+        # Firings saved before these existed were processed with the neighbor ratio filter, which is the first method
+        self.setProperties({'despikeWindow': 7, 'despikeThreshold': 3})
 
         if propDict is not None:
             self.setProperties(propDict)
@@ -27,12 +44,35 @@ class FiringConfig(MotorConfig):
         motorConfig.setProperties(self.getProperties())
         return motorConfig
 
+# Everything derived from the thrust and pressure curves, calculated together in one pass over the arrays
+def computeMetrics(time, force, pressure, throatArea):
+    t = np.asarray(time, dtype=np.float64)
+    f = np.asarray(force, dtype=np.float64)
+    p = np.asarray(pressure, dtype=np.float64)
+    timesteps = np.diff(t)
+    modPressure = np.where(p != 0, p, 1E-6)
+    cf = f / (throatArea * modPressure)
+    return {
+        'impulse': float(np.sum(timesteps * (f[1:] + f[:-1]) / 2)),
+        'integratedPressure': float(np.sum(timesteps * (p[1:] + p[:-1]) / 2)),
+        'peakThrust': float(f.max()) if len(f) > 0 else None,
+        'peakPressure': float(p.max()) if len(p) > 0 else None,
+        'thrustCoefficient': float(getMiddleValue(cf)) if len(cf) > 0 else None,
+        'thrustCoefficientSeries': cf
+    }
+
+# Returns the value that would be in the middle if the values were sorted (the upper one of the two middle values for
+# an even number), without sorting them
+def getMiddleValue(values):
+    middle = len(values) // 2
+    return np.partition(np.asarray(values), middle)[middle]
+
 class MotorResults():
     def __init__(self, time, force, pressure, startupTime, motorInfo, rawData, forceConv, presConv):
+        self._metrics = None
         self.time = time
         self.force = force
         self.pressure = pressure
-        self.numDataPoints = len(time)
 
         self.startupTime = startupTime
         self.motorInfo = motorInfo
@@ -42,6 +82,47 @@ class MotorResults():
         self.nozzleThroat = self.motorInfo.getProperty('throatDiameter')
         self.raw = rawData
 
+    # The metrics are calculated the first time one is needed and kept until the data is replaced. Code that changes
+    # the lists in place has to call invalidateMetrics().
+    @property
+    def time(self):
+        return self._time
+
+    @time.setter
+    def time(self, time):
+        self._time = time
+        self.invalidateMetrics()
+
+    @property
+    def force(self):
+        return self._force
+
+    @force.setter
+    def force(self, force):
+        self._force = force
+        self.invalidateMetrics()
+
+    @property
+    def pressure(self):
+        return self._pressure
+
+    @pressure.setter
+    def pressure(self, pressure):
+        self._pressure = pressure
+        self.invalidateMetrics()
+
+    @property
+    def numDataPoints(self):
+        return len(self._time)
+
+    def invalidateMetrics(self):
+        self._metrics = None
+
+    def getMetrics(self):
+        if self._metrics is None:
+            self._metrics = computeMetrics(self.time, self.force, self.pressure, self.getThroatArea())
+        return self._metrics
+
     def hasForceConverter(self):
         return self.forceConv is not None
 
@@ -61,10 +142,7 @@ class MotorResults():
         return self.force
 
     def getImpulse(self):
-        totalImpulse = 0
-        for i in range(1, self.numDataPoints):
-            totalImpulse += (self.time[i] - self.time[i - 1]) * (self.force[i] + self.force[i - 1]) / 2
-        return totalImpulse
+        return self.getMetrics()['impulse']
 
     def getBurnTime(self):
         return self.time[-1]
@@ -76,7 +154,7 @@ class MotorResults():
         return self.propMass
 
     def getPeakThrust(self):
-        return max(self.force)
+        return self.getMetrics()['peakThrust']
 
     def getAverageThrust(self):
         if self.getBurnTime() == 0:
@@ -84,13 +162,10 @@ class MotorResults():
         return self.getImpulse() / self.getBurnTime()
 
     def getPeakPressure(self):
-        return max(self.pressure)
+        return self.getMetrics()['peakPressure']
 
     def getIntegratedPressure(self):
-        totalPressure = 0
-        for i in range(1, self.numDataPoints):
-            totalPressure += (self.time[i] - self.time[i - 1]) * (self.pressure[i] + self.pressure[i - 1]) / 2
-        return totalPressure
+        return self.getMetrics()['integratedPressure']
 
     def getAveragePressure(self):
         if self.getBurnTime() == 0:
@@ -104,11 +179,20 @@ class MotorResults():
         return self.getThroatArea() * self.getIntegratedPressure() / self.propMass
 
     def getThrustCoefficient(self):
-        throatArea = self.getThroatArea()
-        modPressure = [pressure if abs(pressure) != 0 else 1E-6 for pressure in self.getPressure()]
-        cf = [thrust / (throatArea * pressure) for thrust, pressure in zip(self.getForce(), modPressure)]
-        cf.sort()
-        return cf[int(len(cf) / 2)]
+        return self.getMetrics()['thrustCoefficient']
+
+    # Returns the thrust coefficient at each datapoint
+    def getThrustCoefficientSeries(self):
+        return self.getMetrics()['thrustCoefficientSeries'].tolist()
+
+    # Returns a dictionary of the given percentiles of the thrust coefficient over the firing. The 50th percentile
+    # interpolates between the middle values, so it can differ slightly from getThrustCoefficient.
+    def getThrustCoefficientPercentiles(self, percentiles=(5, 25, 50, 75, 95)):
+        series = self.getMetrics()['thrustCoefficientSeries']
+        if len(series) == 0:
+            return {percentile: None for percentile in percentiles}
+        values = np.percentile(series, percentiles)
+        return {percentile: float(value) for percentile, value in zip(percentiles, values)}
 
     def getMotorDesignation(self):
         imp = self.getImpulse()
@@ -128,25 +212,36 @@ class MotorResults():
     def getRawPressure(self):
         return self.raw['pressure']
 
-    def getCSV(self):
-        out = 'time(s)'
-        if self.hasForceConverter():
-            out += ',force({})'.format('N')
-        if self.hasPressureConverter():
-            out += ',pressure({})'.format('Pa')
-        for i in range(0, self.numDataPoints):
-            out += '\n{:.4f}'.format(self.time[i])
+    # Writes the processed data as CSV to anything with a write method. By default the columns are the time and each
+    # channel that has a converter, and they can be picked from 'time', 'force' and 'pressure' instead.
+    def writeCSV(self, outFile, columns=None, precision=4):
+        if columns is None:
+            columns = ['time']
             if self.hasForceConverter():
-                out += ',{:.4f}'.format(self.force[i])
+                columns.append('force')
             if self.hasPressureConverter():
-                out += ',{:.4f}'.format(self.pressure[i])
-        return out
+                columns.append('pressure')
+        for column in columns:
+            if column not in CSV_COLUMNS:
+                raise ValueError('Unknown CSV column "{}"'.format(column))
+        header = [CSV_COLUMNS[column] for column in columns]
+        data = {'time': self.time, 'force': self.force, 'pressure': self.pressure}
+        rowFormat = ','.join(['{{:.{}f}}'.format(precision)] * len(columns))
+        writeCSV(outFile, header, [data[column] for column in columns], rowFormat)
+
+    def writeRawCSV(self, outFile):
+        header = ['time(ms)', 'force(counts)', 'pressure(counts)']
+        writeCSV(outFile, header, [self.raw['time'], self.raw['force'], self.raw['pressure']], '{},{},{}')
+
+    def getCSV(self):
+        out = io.StringIO()
+        self.writeCSV(out)
+        return out.getvalue()
 
     def getRawCSV(self):
-        out = 'time(ms),force(counts),pressure(counts)'
-        for i in range(0, len(self.raw['time'])):
-            out += "\n{},{},{}".format(self.raw['time'][i], self.raw['force'][i], self.raw['pressure'][i])
-        return out
+        out = io.StringIO()
+        self.writeRawCSV(out)
+        return out.getvalue()
 
     def toDictionary(self):
         out = {
@@ -165,76 +260,84 @@ def rejectOutliers(d):
                 d[i] = (d[i - 1] + d[i + 1]) / 2
     return d
 
+# Gives the same results as rejectOutliers, as an array. Each point is compared to the point before it after that one
+# has been smoothed, so all points are checked against the raw data first and then the points after any that changed
+# are checked again, until nothing else changes.
+def rejectOutliersArray(d):
+    raw = np.array(d, dtype=np.float64)
+    d = raw.copy()
+    if len(d) <= 3:
+        return d
+    indices = np.arange(1, len(d) - 1)
+    while len(indices) > 0:
+        previous = d[indices - 1]
+        following = raw[indices + 1]
+        values = raw[indices]
+        smoothed = np.where((values > 2 * previous) & (values > 2 * following), (previous + following) / 2, values)
+        changed = indices[smoothed != d[indices]]
+        d[indices] = smoothed
+        indices = changed[changed < len(d) - 2] + 1
+    return d
+
+# Removes spikes from a channel of raw readings using the method set in the motor info
+def despike(readings, motorInfo):
+    method = motorInfo.getProperty('despikeMethod')
+    if method == 'Rolling Median':
+        return rollingMedian(readings, motorInfo.getProperty('despikeWindow'))
+    if method == 'Hampel':
+        return hampelFilter(readings, motorInfo.getProperty('despikeWindow'), motorInfo.getProperty('despikeThreshold'))
+    return rejectOutliersArray(readings)
+
 # Returns the indices of the start and end of the firing
 def getTrimPoints(channel, threshold):
-    nearZeroThreshold = max(channel) * threshold
-
-    inRangeOfInterest = False
-    # Ranges of data that _might_ be the firing, but could also be the igniter, a chuff, noise, etc
-    rangesOfInterest = []
-
-    # This loop finds the "ranges of interest", consecutive points that are above the threshold
-    for index, value in enumerate(channel):
-        if value > nearZeroThreshold:
-            if inRangeOfInterest:
-                rangesOfInterest[-1]['total'] += value
-                continue
-            rangesOfInterest.append({
-                    'start': index,
-                    'end': None,
-                    'total': value
-                })
-            inRangeOfInterest = True
-        else:
-            if not inRangeOfInterest:
-                continue
-            rangesOfInterest[-1]['end'] = index
-            inRangeOfInterest = False
-
-    # If the data ends before going back to ~0, close the last range
-    if len(rangesOfInterest[-1]) == 1:
-        rangesOfInterest[-1]['end'] = index
-
-    logger.log('Ranges of interest: {}'.format(rangesOfInterest))
+    channel = np.asarray(channel, dtype=np.float64)
+    nearZeroThreshold = channel.max() * threshold
+
+    # Ranges of data that _might_ be the firing, but could also be the igniter, a chuff, noise, etc. These are runs of
+    # consecutive points that are above the threshold, with the ends exclusive.
+    edges = np.diff(np.concatenate(([0], (channel > nearZeroThreshold).view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
 
     # If there were no regions significantly above 0, bail out
-    if len(rangesOfInterest) == 0:
+    if len(starts) == 0:
         raise ValueError('No firing found in data')
 
-    # The range that has the highest integral is probably the firing
-    roi = max(rangesOfInterest, key = lambda r: r['total'])
-
-    logger.log('Firing is likely in this range: {}'.format(roi))
+    # The range that has the highest integral is probably the firing. The channel is padded so a range can end at the
+    # end of the data, and every other sum is of the gap between two ranges.
+    totals = np.add.reduceat(np.append(channel, 0), np.stack((starts, ends)).ravel('F'))[::2]
+    roi = int(np.argmax(totals))
+    start, end = int(starts[roi]), int(ends[roi])
+    logger.log('Found {} ranges of interest'.format(len(starts)))
+    logger.log('Firing is likely in this range: {}'.format({'start': start, 'end': end, 'total': float(totals[roi])}))
 
     # Find the highest value in the range of interest to trim from
     # Note that this isn't the max of the entire signal, because a chuff, etc might produce a bigger spike than the actual burn
-    roiMaxValue = max(channel[roi['start']:roi['end']])
+    peak = start + int(np.argmax(channel[start:end]))
+    belowCutoff = channel <= threshold * channel[peak]
 
-    # Trim data from the end
-    endCutoff = channel.index(roiMaxValue)
-    while channel[endCutoff] > threshold * roiMaxValue and endCutoff < len(channel) - 1:
-        endCutoff += 1
-    endCutoff = min(endCutoff, len(channel))
+    # Trim data from the end, at the first point after the peak that is below the threshold
+    after = np.flatnonzero(belowCutoff[peak:])
+    endCutoff = peak + int(after[0]) if len(after) > 0 else len(channel) - 1
 
-    # Trim data from the start
-    startCutoff = channel.index(roiMaxValue)
-    while channel[startCutoff] > threshold * roiMaxValue and startCutoff > 0:
-        startCutoff -= 1
+    # Trim data from the start, at the last point before the peak that is below the threshold
+    before = np.flatnonzero(belowCutoff[:peak + 1])
+    startCutoff = int(before[-1]) if len(before) > 0 else 0
 
-    # Increments are because the loops above go to the first point below the threshold
+    # Adjust because the cutoffs are the first points below the threshold
     return startCutoff + 1, endCutoff - 1
 
 NUM_CAL_FRAMES = 10
 
-def processRawData(rawData, forceConv, presConv, motorInfo):
-    t = rawData['time'][:]
-    f = rawData['force'][:]
-    p = rawData['pressure'][:]
-
-    f = rejectOutliers(f)
-    p = rejectOutliers(p)
+# The median of the readings taken before the motor is fired
+def getStartupMedian(readings):
+    middle = NUM_CAL_FRAMES // 2
+    return np.partition(np.asarray(readings[:NUM_CAL_FRAMES]), middle)[middle]
 
-    cutoff = motorInfo.getProperty('cutoffThreshold') / 100
+def processRawData(rawData, forceConv, presConv, motorInfo):
+    t = np.array(rawData['time'], dtype=np.int64)
+    f = despike(rawData['force'], motorInfo)
+    p = despike(rawData['pressure'], motorInfo)
 
     if len(t) == 0:
         raise ValueError('No datapoints')
@@ -242,38 +345,40 @@ def processRawData(rawData, forceConv, presConv, motorInfo):
     # Remove amplifier offset
     # Assumes that there are 10+ points before thrust begins. The firmware waits 10 before firing to make sure.
     if forceConv is not None:
-        startupForces = f[:NUM_CAL_FRAMES]
-        startupForces.sort()
-        startupForcesAverage = startupForces[5]
+        startupForcesAverage = getStartupMedian(f)
         baseForce = forceConv.toRaw(0)
         logger.log('Startup force median: {}, conv: {}'.format(startupForcesAverage, forceConv.convert(startupForcesAverage)))
-        f = [d - startupForcesAverage + baseForce for d in f]
+        f = f - startupForcesAverage + baseForce
 
     if presConv is not None:
-        startupPressures = p[:NUM_CAL_FRAMES]
-        startupPressures.sort()
-        startupPressuresAverage = startupPressures[5]
+        startupPressuresAverage = getStartupMedian(p)
         basePressure = presConv.toRaw(0)
         logger.log('Startup pressure median: {}, conv: {}'.format(startupPressuresAverage, presConv.convert(startupPressuresAverage)))
-        p = [d - startupPressuresAverage + basePressure for d in p]
+        p = p - startupPressuresAverage + basePressure
 
     t = t[NUM_CAL_FRAMES:]
     f = f[NUM_CAL_FRAMES:]
     p = p[NUM_CAL_FRAMES:]
 
-    timesteps = [t[i] - t[i-1] for i in range(1, len(t))]
-    logger.log('Timesteps: min={}, max={}, mean={:.4f}'.format(
-        min(timesteps),
-        max(timesteps),
-        sum(timesteps) / len(timesteps))
-    )
+    timesteps = np.diff(t)
+    logger.log('Timesteps: min={}, max={}, mean={:.4f}'.format(timesteps.min(), timesteps.max(), timesteps.mean()))
 
     # Convert to proper units
-    t = [d / 1000 for d in t]
+    t = t / 1000
     if forceConv is not None:
-        f = forceConv.convertMultiple(f)
+        f = forceConv.convert(f)
     if presConv is not None:
-        p = presConv.convertMultiple(p)
+        p = presConv.convert(p)
+
+    return finishProcessing(t, f, p, rawData['time'][NUM_CAL_FRAMES - 1] / 1000, motorInfo, rawData, forceConv, presConv)
+
+# Trims converted data down to the firing and makes the final adjustments. The times are in seconds and the calibration
+# frames have already been removed. calibrationEnd is the time of the last calibration frame.
+def finishProcessing(t, f, p, calibrationEnd, motorInfo, rawData, forceConv, presConv):
+    t = np.asarray(t, dtype=np.float64)
+    f = np.asarray(f, dtype=np.float64)
+    p = np.asarray(p, dtype=np.float64)
+    cutoff = motorInfo.getProperty('cutoffThreshold') / 100
 
     if forceConv is not None:
         start, end = getTrimPoints(f, cutoff)
@@ -282,13 +387,196 @@ def processRawData(rawData, forceConv, presConv, motorInfo):
     t, f, p = t[start:end], f[start:end], p[start:end]
 
     # Final adjustments and calculations
-    burnTime = t[-1] - t[0]
-    startupTransient = t[0] - (rawData['time'][NUM_CAL_FRAMES - 1] / 1000)
-    t = [d - t[0] for d in t]
+    burnTime = float(t[-1] - t[0])
+    startupTransient = float(t[0] - calibrationEnd)
+    t = t - t[0]
     if motorInfo.getProperty('motorOrientation') == 'Vertical':
         if burnTime == 0:
             burnTime = 0.01
-        for i, time in enumerate(t):
-            f[i] += (time / burnTime) * motorInfo.getProperty('propellantMass') * 9.81
+        f = f + (t / burnTime) * motorInfo.getProperty('propellantMass') * 9.81
+
+    return MotorResults(t.tolist(), f.tolist(), p.tolist(), startupTransient, motorInfo, rawData, forceConv, presConv)
+
+# How far to look on either side of a datapoint for its neighbors before searching the whole store
+NEIGHBOR_SEARCH = 32
+
+# Processes results as they are downloaded into a ResultStore. Datapoints can be added in any order, and only the points
+# around each new one are reworked, so refreshing the results part way through a download doesn't mean starting from
+# scratch each time. process() gives the same results as processRawData on the datapoints received so far, in order.
+class IncrementalProcessor():
+    def __init__(self, store, forceConv, presConv, motorInfo):
+        self.store = store
+        self.forceConv = forceConv
+        self.presConv = presConv
+        self.motorInfo = motorInfo
+
+        # Columns indexed by sequence number, alongside the ones in the store
+        self.time = np.zeros(store.capacity, dtype=np.int64) # Unwrapped, in ms
+        self.smoothForce = np.zeros(store.capacity)
+        self.smoothPressure = np.zeros(store.capacity)
+        # The smoothed channels with the startup offset removed and converted. Converting waits until process() is
+        # called, because that's when the startup median is known.
+        self.convForce = np.zeros(store.capacity)
+        self.convPressure = np.zeros(store.capacity)
+        self._unconvertedForce = []
+        self._unconvertedPressure = []
+        self._forceMedian = None
+        self._pressureMedian = None
+
+    def __len__(self):
+        return len(self.store)
+
+    # Returns False if there was already a datapoint with this sequence number
+    def add(self, seqNum, time, force, pressure):
+        if not self.store.add(seqNum, time, force, pressure):
+            return False
+
+        # The points around the new one, in order. Everything below only looks this far unless a change carries on
+        # further, in which case more points are added to the end.
+        previous = self._previous(seqNum)
+        following = self._next(seqNum)
+        chain = [
+            None if previous is None else self._previous(previous),
+            previous,
+            seqNum,
+            following,
+            None if following is None else self._next(following)
+        ]
+        chain = [i for i in chain if i is not None]
+        self._unwrapFrom(seqNum, chain)
+        if self._isNeighborRatio():
+            self._unconvertedForce += self._rejectOutliersFrom(self.store.force, self.smoothForce, seqNum, chain)
+            self._unconvertedPressure += self._rejectOutliersFrom(self.store.pressure, self.smoothPressure, seqNum,
+                chain)
+        return True
+
+    # Only the neighbor ratio filter is reworked point by point. The others look at a window of points and are fast
+    # enough as arrays that process() runs them over everything instead.
+    def _isNeighborRatio(self):
+        return self.motorInfo.getProperty('despikeMethod') == 'Neighbor Ratio'
+
+    def _despikeAll(self, present):
+        self.smoothForce[present] = despike(self.store.force[present], self.motorInfo)
+        self.smoothPressure[present] = despike(self.store.pressure[present], self.motorInfo)
+        self._unconvertedForce = present
+        self._unconvertedPressure = present
+
+    # The neighbors are found by searching the presence mask as bytes, first close by and then everywhere
+    def _previous(self, seqNum):
+        start = max(seqNum - NEIGHBOR_SEARCH, 0)
+        index = self.store.present[start:seqNum].tobytes().rfind(1)
+        if index == -1 and start > 0:
+            start = 0
+            index = self.store.present[:seqNum].tobytes().rfind(1)
+        return None if index == -1 else start + index
+
+    def _next(self, seqNum):
+        end = seqNum + 1 + NEIGHBOR_SEARCH
+        index = self.store.present[seqNum + 1:end].tobytes().find(1)
+        if index == -1 and end < self.store.capacity:
+            index = self.store.present[seqNum + 1:].tobytes().find(1)
+        return None if index == -1 else seqNum + 1 + index
+
+    # Returns the next point in the chain, extending it if needed
+    def _chainNext(self, chain, position):
+        if position + 1 < len(chain):
+            return chain[position + 1]
+        following = self._next(chain[position])
+        if following is not None:
+            chain.append(following)
+        return following
+
+    # Adjusts for 16 bit time rolling over, the same way as unwrapTime would over all of the data. Each time is
+    # unwrapped relative to the one before it, so after the new point this only continues until the times stop changing.
+    def _unwrapFrom(self, seqNum, chain):
+        rawTime = self.store.time
+        position = chain.index(seqNum)
+        current = seqNum
+        while current is not None:
+            unwrapped = int(rawTime[current])
+            if position > 0:
+                previous = chain[position - 1]
+                unwrapped = unwrapNext(int(rawTime[previous]), int(self.time[previous]), unwrapped)
+            if current != seqNum and unwrapped == self.time[current]:
+                return
+            self.time[current] = unwrapped
+            current = self._chainNext(chain, position)
+            position += 1
+
+    # Applies the same steps as rejectOutliers, starting from the first point the new one can affect and stopping once
+    # the results match what was there before. Returns the sequence numbers of the smoothed values that changed.
+    def _rejectOutliersFrom(self, raw, smoothed, seqNum, chain):
+        if len(self) <= 4:
+            present = self.store.getSeqNums()
+            smoothed[present] = rejectOutliers(raw[present].tolist())
+            return present.tolist()
+        changed = []
+        # The point before the new one has a new neighbor, so it starts there
+        position = max(chain.index(seqNum) - 1, 0)
+        current = chain[position]
+        while current is not None:
+            following = self._chainNext(chain, position)
+            value = int(raw[current])
+            if position > 0 and following is not None:
+                previous = float(smoothed[chain[position - 1]])
+                if value > 2 * previous and value > 2 * raw[following]:
+                    value = (previous + int(raw[following])) / 2
+            if current > seqNum and value == smoothed[current]:
+                break
+            smoothed[current] = value
+            changed.append(current)
+            current = following
+            position += 1
+        return changed
+
+    def _convert(self, converter, smoothed, converted, median, changed):
+        if converter is None:
+            converted[changed] = smoothed[changed]
+            return
+        base = converter.toRaw(0)
+        converted[changed] = converter.convert(smoothed[changed] - median + base)
+
+    # Converts the points that have changed since the last call. Points before the startup frames being filled in can
+    # shift the startup median, which means converting everything again.
+    def _updateConversions(self, present):
+        forceMedian = 0
+        if self.forceConv is not None:
+            forceMedian = getStartupMedian(self.smoothForce[present[:NUM_CAL_FRAMES]].tolist())
+        if forceMedian != self._forceMedian:
+            self._forceMedian = forceMedian
+            self._unconvertedForce = present
+        self._convert(self.forceConv, self.smoothForce, self.convForce, forceMedian, self._unconvertedForce)
+        self._unconvertedForce = []
+
+        pressureMedian = 0
+        if self.presConv is not None:
+            pressureMedian = getStartupMedian(self.smoothPressure[present[:NUM_CAL_FRAMES]].tolist())
+        if pressureMedian != self._pressureMedian:
+            self._pressureMedian = pressureMedian
+            self._unconvertedPressure = present
+        self._convert(self.presConv, self.smoothPressure, self.convPressure, pressureMedian, self._unconvertedPressure)
+        self._unconvertedPressure = []
+
+    def getRawData(self):
+        present = self.store.getSeqNums()
+        return {
+            'time': self.time[present].tolist(),
+            'force': self.store.force[present].tolist(),
+            'pressure': self.store.pressure[present].tolist()
+        }
 
-    return MotorResults(t, f, p, startupTransient, motorInfo, rawData, forceConv, presConv)
+    def process(self):
+        if len(self) == 0:
+            raise ValueError('No datapoints')
+        present = self.store.getSeqNums()
+        if not self._isNeighborRatio():
+            self._despikeAll(present)
+        self._updateConversions(present)
+        logger.log('Processing {} datapoints incrementally'.format(len(self)))
+        processed = present[NUM_CAL_FRAMES:]
+        t = self.time[processed] / 1000
+        f = self.convForce[processed]
+        p = self.convPressure[processed]
+        calibrationEnd = self.time[present[NUM_CAL_FRAMES - 1]] / 1000
+        return finishProcessing(t, f, p, float(calibrationEnd), self.motorInfo, self.getRawData(), self.forceConv,
+            self.presConv)
@@ -0,0 +1,77 @@
+from threading import Thread, Condition
+from time import monotonic
+from traceback import format_exc
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from .logger import logger
+
+# Runs an IncrementalProcessor on its own thread so that processing results doesn't hold up the GUI. Datapoints are
+# handed over with add() and results are asked for with request(). Requests made while the processor is busy collapse
+# into one run on the newest data once it is done, and if the thread that created the worker falls behind on handling
+# newResults, it only gets the newest results when it catches up.
+class ProcessingWorker(QObject):
+    newResults = pyqtSignal(object)
+    _resultsReady = pyqtSignal()
+
+    def __init__(self, processor):
+        super().__init__()
+        self.processor = processor
+        self._condition = Condition()
+        self._pending = []
+        self._requested = False
+        self._running = True
+        self._latestResults = None
+        # How many seconds the last run of the processor took
+        self.processingTime = 0
+        self._resultsReady.connect(self._deliverResults)
+        self._thread = Thread(target=self._processingThread)
+        self._thread.start()
+
+    def add(self, seqNum, time, force, pressure):
+        with self._condition:
+            self._pending.append((seqNum, time, force, pressure))
+
+    def request(self):
+        with self._condition:
+            self._requested = True
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+
+    def _processingThread(self):
+        while True:
+            with self._condition:
+                while self._running and not self._requested:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                pending = self._pending
+                self._pending = []
+                self._requested = False
+
+            start = monotonic()
+            for datapoint in pending:
+                self.processor.add(*datapoint)
+            try:
+                results = self.processor.process()
+            except Exception:
+                logger.error('Could not process results. Error: {}'.format(format_exc()))
+                continue
+            finally:
+                self.processingTime = monotonic() - start
+
+            with self._condition:
+                self._latestResults = results
+            self._resultsReady.emit()
+
+    # Runs on the thread the worker was created on, since _resultsReady is queued there
+    def _deliverResults(self):
+        with self._condition:
+            results = self._latestResults
+            self._latestResults = None
+        if results is not None:
+            self.newResults.emit(results)
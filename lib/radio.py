@@ -1,33 +1,40 @@
-import serial
+import struct
 import time
-from threading import Thread
+from threading import Thread, Event, Lock
 
 from PyQt6.QtCore import QObject, pyqtSignal
 
 from .errors import formatErrorMessage
 from .logger import logger
+from .sendScheduler import SendScheduler, SEND_PRIORITY
+from .radioStats import RadioStats, formatStats
+from .transports import createTransport
+from .radioLoop import radioLoop, earliest
+from .capture import CaptureWriter, CAPTURE_DIRECTION
+from .seenBitmap import SeenBitmap
+
+# Type, checksum, and sequence number, followed by the 8 byte payload read as one little endian integer that the
+# packet types pull their fields out of with shifts and masks
+FRAME_LAYOUT = struct.Struct('<BBHQ')
+MASK_8_BIT = 0xFF
+MASK_16_BIT = 0xFFFF
+MASK_24_BIT = 0xFFFFFF
 
 class RadioRecvPacket():
+    __slots__ = ('type', 'checksum', 'seqNum')
+
     def __init__(self, data):
         if data is None:
             return
-        self.type = data[0]
-        self.checksum = data[1]
-        self.seqNum = self.interpret16Bit(data[2:4])
-        self.payload = data[4:12]
-
-    def interpret24Bit(self, data):
-        low = data[0]
-        mid = data[1]
-        high = data[2]
-        return (low) + (mid * (2**8)) + (high * (2**16))
-
-    def interpret16Bit(self, data):
-        low = data[0]
-        high = data[1]
-        return (low) + (high * (2**8))
+        self.type, self.checksum, self.seqNum, payload = FRAME_LAYOUT.unpack_from(data)
+        self.unpackPayload(payload)
+
+    def unpackPayload(self, payload):
+        pass
 
 class RadioSendPacket():
+    PRIORITY = SEND_PRIORITY.NORMAL
+
     def __init__(self, packetType, seqNum):
         self.type = packetType
         self.seqNum = seqNum
@@ -45,41 +52,46 @@ class RadioSendPacket():
         return "Unlabeled packet with type {}".format(self.type)
 
 class SetupPacket(RadioRecvPacket):
-    def __init__(self, data):
-        super().__init__(data)
-        self.force = self.interpret24Bit(self.payload[0:])
-        self.pressure = self.interpret24Bit(self.payload[3:])
-        self.continuity = bool(self.payload[6])
+    __slots__ = ('force', 'pressure', 'continuity')
+
+    def unpackPayload(self, payload):
+        self.force = payload & MASK_24_BIT
+        self.pressure = (payload >> 24) & MASK_24_BIT
+        self.continuity = bool((payload >> 48) & MASK_8_BIT)
 
     def __str__(self):
         return "Force: {}, Pressure: {}, Continuity: {}".format(self.force, self.pressure, self.continuity)
 
 class VersionPacket(RadioRecvPacket):
-    def __init__(self, data):
-        super().__init__(data)
-        self.firmwareVersion = self.interpret16Bit(self.payload[0:2])
-        self.hardwareVersion = self.payload[2]
+    __slots__ = ('firmwareVersion', 'hardwareVersion')
+
+    def unpackPayload(self, payload):
+        self.firmwareVersion = payload & MASK_16_BIT
+        self.hardwareVersion = (payload >> 16) & MASK_8_BIT
 
     def __str__(self):
         return "Hardware Version: {}, Firmware Version: {}".format(self.hardwareVersion, self.firmwareVersion)
 
 class FiringPacket(RadioRecvPacket):
-    def __init__(self, data):
-        super().__init__(data)
-        self.force = self.interpret24Bit(self.payload[0:])
-        self.pressure = self.interpret24Bit(self.payload[3:])
-        self.time = self.payload[6] + ((self.payload[7] & 0xFE) * (2 ** 7))
-        self.continuity = bool(self.payload[7] & 0b1)
+    __slots__ = ('force', 'pressure', 'time', 'continuity')
+
+    def unpackPayload(self, payload):
+        self.force = payload & MASK_24_BIT
+        self.pressure = (payload >> 24) & MASK_24_BIT
+        # The lowest bit of the last byte is the continuity flag, and the rest of the last two bytes are the time
+        self.time = ((payload >> 48) & MASK_8_BIT) + (((payload >> 56) & 0xFE) << 7)
+        self.continuity = bool((payload >> 56) & 0b1)
 
     def __str__(self):
         return "Force: {}, Pressure: {}, Time: {}, Continuity: {}".format(self.force, self.pressure, self.time, self.continuity)
 
 
 class ErrorPacket(RadioRecvPacket):
-    def __init__(self, data):
-        super().__init__(data)
-        self.storageError = self.payload[0]
-        self.adcError = self.payload[1]
+    __slots__ = ('storageError', 'adcError')
+
+    def unpackPayload(self, payload):
+        self.storageError = payload & MASK_8_BIT
+        self.adcError = (payload >> 8) & MASK_8_BIT
 
     def __str__(self):
         out = "Storage: {}, ADC: {}".format(self.storageError, self.adcError)
@@ -96,13 +108,12 @@ class ErrorPacket(RadioRecvPacket):
         return [self.storageError, self.adcError, 0] # Radio errors are currently not sent
 
 class ResultPacket(RadioRecvPacket):
-    def __init__(self, data):
-        super().__init__(data)
-        if data is None:
-            return
-        self.time = self.interpret16Bit(self.payload)
-        self.force = self.interpret24Bit(self.payload[2:])
-        self.pressure = self.interpret24Bit(self.payload[5:])
+    __slots__ = ('time', 'force', 'pressure')
+
+    def unpackPayload(self, payload):
+        self.time = payload & MASK_16_BIT
+        self.force = (payload >> 16) & MASK_24_BIT
+        self.pressure = (payload >> 40) & MASK_24_BIT
 
     def __str__(self):
         out = "#: {}, Time: {}, Force: {}, Pressure: {}".format(self.seqNum, self.time, self.force, self.pressure)
@@ -117,6 +128,8 @@ class ResultPacket(RadioRecvPacket):
         return timeValid and forceValid and pressureValid
 
 class FirePacket(RadioSendPacket):
+    PRIORITY = SEND_PRIORITY.HIGH
+
     def __init__(self, fireDuration):
         super().__init__(128, 0)
         self.fireDuration = fireDuration
@@ -130,6 +143,8 @@ class FirePacket(RadioSendPacket):
         return 'Fire packet, duration = {} ms'.format(self.fireDuration)
 
 class StopPacket(RadioSendPacket):
+    PRIORITY = SEND_PRIORITY.HIGH
+
     def __init__(self):
         super().__init__(129, 0)
 
@@ -154,10 +169,102 @@ class CalStopPacket(RadioSendPacket):
         return self.padPayload([])
 
 
+# Splits the stream of bytes from the radio into complete frames. Data can be fed in chunks of any size, and partial
+# frames are carried over between calls.
+class FrameDecoder():
+    def __init__(self, stats=None):
+        self.stats = stats if stats is not None else RadioStats()
+        self.packetSize = RadioManager.PACKET_SIZE
+        self.preambleStart = RadioManager.PREAMBLE[0]
+        self.preambleEnd = RadioManager.PREAMBLE[1]
+        self.escapeByte = RadioManager.ESCAPE
+        self.reset()
+
+    def reset(self):
+        self.escape = False
+        self.inPreamble = False
+        self.inPacket = False
+        self.overflow = False
+        self.frame = bytearray()
+
+    # Returns a list of the complete, checksum-valid frames in the data. Frames that arrive whole and without escapes
+    # are returned as memoryviews into the data rather than copies.
+    def feed(self, data):
+        frames = []
+        view = memoryview(data)
+        index = 0
+        length = len(data)
+        self.stats.bytesReceived += length
+        while index < length:
+            if self.inPacket and not self.escape and not self.overflow:
+                # Fast path: take the rest of the frame in one go if it doesn't contain any framing bytes
+                need = self.packetSize - len(self.frame)
+                end = index + need
+                if end <= length and self._isPlain(data, index, end):
+                    if need == self.packetSize:
+                        self._checkFrame(view[index:end], frames)
+                    else:
+                        self.frame += view[index:end]
+                        self._checkFrame(self.frame, frames)
+                    index = end
+                    continue
+            self._feedByte(data[index], frames)
+            index += 1
+        return frames
+
+    def _isPlain(self, data, start, end):
+        return (data.find(self.preambleStart, start, end) == -1 and data.find(self.preambleEnd, start, end) == -1
+            and data.find(self.escapeByte, start, end) == -1)
+
+    def _feedByte(self, byte, frames):
+        if byte == self.preambleStart and not self.escape:
+            self._dropPartialFrame()
+            self.inPreamble = True
+            self.inPacket = False
+        elif byte == self.preambleEnd and not self.escape and self.inPreamble:
+            self._dropPartialFrame()
+            self.frame = bytearray()
+            self.overflow = False
+            self.inPacket = True
+        elif self.inPacket and (byte != self.escapeByte or self.escape):
+            if not self.overflow:
+                self.frame.append(byte)
+                self._checkFrame(self.frame, frames)
+        self.escape = byte == self.escapeByte and not self.escape
+        if self.escape:
+            self.stats.escapes += 1
+
+    def _dropPartialFrame(self):
+        if self.inPacket and not self.overflow and len(self.frame) > 0:
+            self.stats.droppedFrames += 1
+
+    def _checkFrame(self, frame, frames):
+        if len(frame) < self.packetSize:
+            return
+        if RadioManager.checkPacket(frame):
+            frames.append(frame if isinstance(frame, memoryview) else bytes(frame))
+            self.inPacket = False
+        else:
+            # A full frame with a bad checksum can never become valid, so ignore everything until the next preamble
+            self.stats.checksumFailures += 1
+            self.overflow = True
+
+
 class RadioManager(QObject):
     PACKET_SIZE = 12
     PREAMBLE = [0xAA, 0xBB]
     ESCAPE = 0x11
+    BAUD_RATE = 9600
+
+    # In batched mode, the shortest time between deliveries of packets to the main thread
+    BATCH_INTERVAL = 0.05
+    # How often link statistics are updated and sent out through newStats, and how often they are logged if enabled
+    STATS_INTERVAL = 1
+    STATS_LOG_INTERVAL = 10
+
+    RESULT_PACKET_TYPE = 2
+    # Result sequence numbers are 16 bits
+    RESULT_SEQ_NUM_COUNT = 2 ** 16
 
     PACKET_TYPE_MAP = {
         0: SetupPacket,
@@ -168,14 +275,43 @@ class RadioManager(QObject):
     }
 
     newPacket = pyqtSignal(object)
-
-    def __init__(self):
+    newPackets = pyqtSignal(list)
+    newStats = pyqtSignal(dict)
+    duplicateResults = pyqtSignal(int)
+
+    # In batched mode, received packets are delivered in lists through newPackets instead of one at a time through
+    # newPacket, so a fast stream of packets doesn't queue up an event per packet on the main thread. If capturePath is
+    # set, every byte sent or received is recorded to a capture file there that can be replayed later. The board sends
+    # each result many times, so if suppressDuplicateResults is set, only the first valid copy of each result is built
+    # and delivered. The rest are only counted and reported through duplicateResults, which in batched mode is sent
+    # along with each batch.
+    def __init__(self, batchPackets=False, logStats=False, baudRate=BAUD_RATE, capturePath=None,
+            suppressDuplicateResults=False):
         super().__init__()
-        self.toSend = []
-        self.clearOutputBuffer = False
+        self.baudRate = baudRate
+        self.capturePath = capturePath
+        self._capture = None
+        self.batchPackets = batchPackets
+        self.logStats = logStats
+        self._packetBatch = []
+        self._lastBatchSent = 0
+        self.suppressDuplicateResults = suppressDuplicateResults
+        self._seenResults = SeenBitmap(RadioManager.RESULT_SEQ_NUM_COUNT)
+        # Guards _seenResults, which consumers can change from their own threads
+        self._seenLock = Lock()
+        self._duplicateBatch = 0
+        self.stats = RadioStats()
+        self._lastStatsUpdate = 0
+        self._lastStatsLog = 0
+        self.sendScheduler = SendScheduler(baudRate)
         self.port = None
         self._lastPacketRecv = 0
-        self.setupSerialThread()
+        self._transport = None
+        self._decoder = None
+        self.running = False
+        # Set while the manager isn't registered with the radio loop
+        self._closed = Event()
+        self._closed.set()
 
     @staticmethod
     def checkPacket(packet):
@@ -189,73 +325,174 @@ class RadioManager(QObject):
         seqNumHigh = (packet.seqNum >> 8) & 0xFF
         pack = [packet.type, 0, seqNumLow, seqNumHigh] + packet.getPayload()
         pack[1] = (256 - sum(pack)) % 256
-        for i in range(0, resendCount):
-            self.toSend.append(bytearray(RadioManager.PREAMBLE + pack))
+        self.sendScheduler.add(bytearray(RadioManager.PREAMBLE + pack), resendCount, packet.PRIORITY)
+        self.stats.recordSendQueueDepth(self.sendScheduler.pending())
+        radioLoop.wake()
 
     def clearSendBuffer(self):
-        self.clearOutputBuffer = True
+        self.sendScheduler.clear()
+
+    # Forgets which results have been received, so that the next copy of each one is delivered again. Consumers that
+    # had to drop results, like ones that arrived before the board's version was checked, use this to get them back.
+    def forgetResults(self):
+        with self._seenLock:
+            self._seenResults.clear()
+            self.stats.uniqueResults = 0
+
+    # Marks results the consumer already has from somewhere else as received, so copies of them are treated as repeats
+    def markResultsSeen(self, seqNums):
+        with self._seenLock:
+            for seqNum in seqNums:
+                self._seenResults.add(seqNum)
+            self.stats.uniqueResults = self._seenResults.count
 
     def buildPacket(self, packetData):
         if packetData[0] not in RadioManager.PACKET_TYPE_MAP.keys():
             logger.error('Invalid packet with type {} received'.format(packetData[0]))
+            self.stats.invalidTypes += 1
             return
+        isResult = packetData[0] == RadioManager.RESULT_PACKET_TYPE
+        if isResult:
+            with self._seenLock:
+                seen = (packetData[2] | (packetData[3] << 8)) in self._seenResults
+            if seen:
+                self.stats.duplicateResults += 1
+                if self.suppressDuplicateResults:
+                    self._reportDuplicate()
+                    return
         packetCons = RadioManager.PACKET_TYPE_MAP[packetData[0]]
         pack = packetCons(packetData)
-        self.newPacket.emit(pack)
-
-    def setupSerialThread(self):
-        self.serialThread = Thread(target=self._serialThread)
-        self.running = False
-        self.closed = False
-
-    def _serialThread(self):
-        with serial.Serial(self.port, 9600) as serport:
-            logger.log('Connected to radio on port ({})'.format(self.port))
-            self.closed = False
-            escape = False
-            packetBuff = []
-            inPreamble = False
-            inPacket = False
-            while self.running:
-                while serport.in_waiting > 0 and len(self.toSend) == 0:
-                    b = int.from_bytes(serport.read(), 'big')
-                    if b == RadioManager.PREAMBLE[0] and not escape:
-                        inPreamble = True
-                        inPacket = False
-                    elif b == RadioManager.PREAMBLE[1] and not escape and inPreamble:
-                        packetBuff = []
-                        inPacket = True
-                    elif inPacket and (b != RadioManager.ESCAPE or escape):
-                        packetBuff.append(b)
-                        if self.checkPacket(packetBuff):
-                            self.buildPacket(packetBuff)
-                            inPacket = False
-                    escape = b == RadioManager.ESCAPE and not escape
-
-                if len(self.toSend) > 0:
-                    packet = self.toSend.pop(0)
-                    serport.write(packet)
-
-                if self.clearOutputBuffer:
-                    self.toSend = []
-                    self.clearOutputBuffer = False
-
-        self.closed = True
-        logger.log('Serial thread exited')
+        # Results that fail validation aren't marked as seen so that a good copy can still come through later
+        if isResult and pack.validate():
+            with self._seenLock:
+                self._seenResults.add(pack.seqNum)
+                self.stats.uniqueResults = self._seenResults.count
+        if self.batchPackets:
+            self._packetBatch.append(pack)
+        else:
+            self.newPacket.emit(pack)
+
+    # Delivers the current batch if enough time has passed since the last one. Returns how long until the rest of the
+    # batch is due, or None if there is nothing waiting.
+    def _sendPacketBatch(self, force=False):
+        if len(self._packetBatch) == 0 and self._duplicateBatch == 0:
+            return None
+        now = time.monotonic()
+        if not force and now - self._lastBatchSent < RadioManager.BATCH_INTERVAL:
+            return RadioManager.BATCH_INTERVAL - (now - self._lastBatchSent)
+        if len(self._packetBatch) > 0:
+            self.newPackets.emit(self._packetBatch)
+            self._packetBatch = []
+        if self._duplicateBatch > 0:
+            self.duplicateResults.emit(self._duplicateBatch)
+            self._duplicateBatch = 0
+        self._lastBatchSent = now
+        return None
+
+    def _reportDuplicate(self):
+        if self.batchPackets:
+            self._duplicateBatch += 1
+        else:
+            self.duplicateResults.emit(1)
+
+    # The methods below up to run() are called from the radio loop's thread
+    def _connect(self):
+        transport = createTransport(self.port, self.baudRate)
+        transport.open()
+        self._transport = transport
+        logger.log('Connected to radio on port ({}) using {}'.format(self.port, transport))
+        if self.capturePath is not None:
+            logger.log('Capturing radio traffic to ({})'.format(self.capturePath))
+            self._capture = CaptureWriter(self.capturePath)
+        self.stats = RadioStats()
+        self._lastStatsUpdate = self._lastStatsLog = time.monotonic()
+        self._decoder = FrameDecoder(self.stats)
+        with self._seenLock:
+            self._seenResults.clear()
+
+    def _disconnect(self):
+        try:
+            if self._transport is not None:
+                self._sendPacketBatch(True)
+                self._updateStats(True)
+                self._transport.close()
+        finally:
+            self._transport = None
+            self._decoder = None
+            if self._capture is not None:
+                self._capture.close()
+                self._capture = None
+            self.running = False
+            self._closed.set()
+            logger.log('Radio on port ({}) closed'.format(self.port))
+
+    # Sends whatever is due and returns how long until something else will be, or None if nothing is waiting
+    def _service(self):
+        self._updateStats()
+        # Stats are due every STATS_INTERVAL even if the link is quiet
+        untilStats = max(RadioManager.STATS_INTERVAL - (time.monotonic() - self._lastStatsUpdate), 0)
+        return earliest(untilStats, earliest(self._sendQueuedPackets(), self._sendPacketBatch()))
+
+    # Decodes whatever the transport has received. Returns False once the connection has ended.
+    def _receive(self):
+        data = self._transport.read()
+        if data is None:
+            logger.log('Radio connection on port ({}) ended'.format(self.port))
+            return False
+        if len(data) == 0:
+            return True
+        if self._capture is not None:
+            self._capture.record(CAPTURE_DIRECTION.RECEIVED, data)
+        frames = self._decoder.feed(data)
+        self.stats.recordFrames(len(frames))
+        for frame in frames:
+            self.buildPacket(frame)
+        return True
+
+    # Writes as many queued packets as the link has room for. Returns how long until the next one can be sent, or None
+    # if there is nothing left to send.
+    def _sendQueuedPackets(self):
+        while True:
+            frame, delay = self.sendScheduler.nextFrame()
+            if frame is None:
+                return delay
+            self._transport.write(frame)
+            if self._capture is not None:
+                self._capture.record(CAPTURE_DIRECTION.SENT, frame)
+            self.stats.bytesSent += len(frame)
+            self.stats.framesSent += 1
+            self.stats.recordSendQueueDepth(self.sendScheduler.pending())
+
+    def _updateStats(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._lastStatsUpdate < RadioManager.STATS_INTERVAL:
+            return
+        self.stats.update()
+        self._lastStatsUpdate = now
+        stats = self.stats.snapshot()
+        self.newStats.emit(stats)
+        if self.logStats and (force or now - self._lastStatsLog >= RadioManager.STATS_LOG_INTERVAL):
+            logger.log('Radio link on ({}): {}'.format(self.port, formatStats(stats)))
+            self._lastStatsLog = now
+
+    # Returns the link statistics for the current (or last) connection
+    def getStats(self):
+        return self.stats.snapshot()
 
     def run(self, port):
-        if self.running:
-            self.stop()
-            self.setupSerialThread()
-            while not self.closed and port == self.port:
-                logger.warn("Waiting for port to close before reopening.")
-                pass
+        if not self._closed.is_set():
+            logger.log('Waiting for port to close before reopening.')
+            self.stop(True)
         self.port = port
         self.running = True
-        self.serialThread.start()
+        self._closed.clear()
+        radioLoop.add(self)
 
-    def stop(self):
+    def stop(self, wait=False):
         self.running = False
+        radioLoop.wake()
+        if wait and not radioLoop.isLoopThread():
+            self._closed.wait()
 
     def runCalibration(self):
         calThread = Thread(target=self._calibrationThread)
@@ -0,0 +1,139 @@
+import selectors
+import socket
+from threading import Thread, Lock, current_thread
+from traceback import format_exc
+
+from .logger import logger
+
+# Returns the sooner of two delays, where None means there is nothing to wait for
+def earliest(first, second):
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return min(first, second)
+
+# A single thread that runs the radio protocol for every radio manager that is connected, so watching several boards
+# doesn't take a thread per board. It waits on all of the transports at once with select and only wakes up when data
+# arrives, when a manager has packets or stats due, or when another thread calls wake(). Transports that select can't
+# wait on are polled as often as they ask to be. The thread exits when there are no managers left and is started again
+# by the next call to add().
+class RadioLoop():
+    def __init__(self):
+        self._lock = Lock()
+        self._managers = []
+        self._thread = None
+        self._wakeRecv, self._wakeSend = socket.socketpair()
+        self._wakeRecv.setblocking(False)
+        self._wakeSend.setblocking(False)
+
+    def add(self, manager):
+        with self._lock:
+            self._managers.append(manager)
+            if self._thread is None:
+                self._thread = Thread(target=self._run)
+                self._thread.start()
+        self.wake()
+
+    # Makes the loop check every manager for packets to send or a request to stop right away
+    def wake(self):
+        try:
+            self._wakeSend.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass # There is already a wakeup pending
+
+    def isLoopThread(self):
+        return current_thread() is self._thread
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeRecv, selectors.EVENT_READ)
+        # The file descriptor each connected manager's transport was registered with, if any
+        connected = {}
+        try:
+            while True:
+                with self._lock:
+                    managers = self._managers[:]
+                    if len(managers) == 0:
+                        self._thread = None
+                        return
+
+                timeout = None
+                for manager in managers:
+                    if manager not in connected and not self._connect(manager, selector, connected):
+                        continue
+                    if not manager.running:
+                        self._disconnect(manager, selector, connected)
+                        continue
+                    try:
+                        timeout = earliest(timeout, manager._service())
+                        timeout = earliest(timeout, manager._transport.pollDelay())
+                    except Exception:
+                        self._fail(manager, selector, connected)
+                if len(connected) == 0:
+                    continue # Every manager was closed, so check if the thread should exit
+
+                ready = set()
+                for key, events in selector.select(timeout):
+                    if key.fileobj is self._wakeRecv:
+                        self._drainWakeups()
+                    else:
+                        ready.add(key.data)
+                for manager, fileno in list(connected.items()):
+                    if manager not in ready and fileno is not None:
+                        continue
+                    try:
+                        if not manager._receive():
+                            self._disconnect(manager, selector, connected)
+                    except Exception:
+                        self._fail(manager, selector, connected)
+        finally:
+            selector.close()
+
+    # Opens the manager's transport, or removes the manager if it has been stopped or the transport can't be opened
+    def _connect(self, manager, selector, connected):
+        if manager.running:
+            try:
+                manager._connect()
+                fileno = manager._transport.fileno()
+                if fileno is not None:
+                    selector.register(fileno, selectors.EVENT_READ, manager)
+                connected[manager] = fileno
+                return True
+            except Exception:
+                logger.error('Could not open radio on port ({}). Error: {}'.format(manager.port, format_exc()))
+        self._remove(manager)
+        self._close(manager)
+        return False
+
+    def _disconnect(self, manager, selector, connected):
+        fileno = connected.pop(manager)
+        if fileno is not None:
+            selector.unregister(fileno)
+        self._remove(manager)
+        self._close(manager)
+
+    # Closing can fail if the device has gone away, which shouldn't stop the loop from serving the other managers
+    def _close(self, manager):
+        try:
+            manager._disconnect()
+        except Exception:
+            logger.error('Could not close radio on port ({}). Error: {}'.format(manager.port, format_exc()))
+
+    # Closes the connection of a manager that raised an error without disturbing the others
+    def _fail(self, manager, selector, connected):
+        logger.error('Radio on port ({}) failed. Error: {}'.format(manager.port, format_exc()))
+        self._disconnect(manager, selector, connected)
+
+    def _remove(self, manager):
+        with self._lock:
+            self._managers.remove(manager)
+
+    def _drainWakeups(self):
+        try:
+            while self._wakeRecv.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+radioLoop = RadioLoop()
@@ -0,0 +1,127 @@
+from bisect import bisect_left
+from threading import Lock
+from time import monotonic
+
+# Upper edges of the histogram bins. Each histogram has one more bin for everything above the last edge.
+PACKET_INTERVAL_BINS = [0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5, 1]
+SEND_QUEUE_DEPTH_BINS = [0, 1, 2, 5, 10, 20, 50]
+
+# The rates that are calculated, and the counters they are calculated from
+RATE_COUNTERS = {
+    'bytesPerSecond': 'bytesReceived',
+    'framesPerSecond': 'framesReceived',
+    'escapesPerSecond': 'escapes',
+    'checksumFailuresPerSecond': 'checksumFailures',
+    'duplicateResultsPerSecond': 'duplicateResults'
+}
+
+class Histogram():
+    def __init__(self, edges):
+        self.edges = edges
+        self.counts = [0 for i in range(len(edges) + 1)]
+
+    def add(self, value, count=1):
+        self.counts[bisect_left(self.edges, value)] += count
+
+    def toDictionary(self):
+        return {'edges': self.edges[:], 'counts': self.counts[:]}
+
+# Counters for everything that happens on a radio link. The radio loop updates the totals as it goes and calls
+# update() periodically to calculate rates over the last interval.
+class RadioStats():
+    def __init__(self):
+        self._lock = Lock()
+        self.startTime = monotonic()
+
+        self.bytesReceived = 0
+        self.bytesSent = 0
+        self.framesReceived = 0
+        self.framesSent = 0
+        self.checksumFailures = 0
+        self.escapes = 0
+        self.droppedFrames = 0
+        self.invalidTypes = 0
+        # Result packets with a sequence number that has already been received, and how many distinct ones there were
+        self.duplicateResults = 0
+        self.uniqueResults = 0
+
+        self.sendQueueDepth = 0
+        self.maxSendQueueDepth = 0
+
+        self.packetIntervals = Histogram(PACKET_INTERVAL_BINS)
+        self.sendQueueDepths = Histogram(SEND_QUEUE_DEPTH_BINS)
+        self._lastFrameTime = None
+
+        self.rates = {rate: 0 for rate in RATE_COUNTERS}
+        self._lastUpdate = self.startTime
+        self._lastTotals = self._getTotals()
+
+    # Called with the number of frames decoded from one read. The frames in a read arrived at about the same time, so
+    # the time since the last frame is split evenly between them.
+    def recordFrames(self, count):
+        if count == 0:
+            return
+        now = monotonic()
+        self.framesReceived += count
+        if self._lastFrameTime is not None:
+            with self._lock:
+                self.packetIntervals.add((now - self._lastFrameTime) / count, count)
+        self._lastFrameTime = now
+
+    def recordSendQueueDepth(self, depth):
+        with self._lock:
+            self.sendQueueDepth = depth
+            self.maxSendQueueDepth = max(self.maxSendQueueDepth, depth)
+            self.sendQueueDepths.add(depth)
+
+    def _getTotals(self):
+        return {rate: getattr(self, counter) for rate, counter in RATE_COUNTERS.items()}
+
+    def update(self):
+        now = monotonic()
+        elapsed = now - self._lastUpdate
+        if elapsed <= 0:
+            return
+        totals = self._getTotals()
+        with self._lock:
+            self.rates = {rate: (totals[rate] - self._lastTotals[rate]) / elapsed for rate in totals}
+        self._lastTotals = totals
+        self._lastUpdate = now
+
+    # The fraction of result packets received that were repeats of ones already received
+    def getDuplicateRatio(self):
+        total = self.duplicateResults + self.uniqueResults
+        if total == 0:
+            return 0
+        return self.duplicateResults / total
+
+    def snapshot(self):
+        with self._lock:
+            out = {
+                'duration': monotonic() - self.startTime,
+                'bytesReceived': self.bytesReceived,
+                'bytesSent': self.bytesSent,
+                'framesReceived': self.framesReceived,
+                'framesSent': self.framesSent,
+                'checksumFailures': self.checksumFailures,
+                'escapes': self.escapes,
+                'droppedFrames': self.droppedFrames,
+                'invalidTypes': self.invalidTypes,
+                'duplicateResults': self.duplicateResults,
+                'uniqueResults': self.uniqueResults,
+                'duplicateRatio': self.getDuplicateRatio(),
+                'sendQueueDepth': self.sendQueueDepth,
+                'maxSendQueueDepth': self.maxSendQueueDepth,
+                'packetIntervals': self.packetIntervals.toDictionary(),
+                'sendQueueDepths': self.sendQueueDepths.toDictionary()
+            }
+            out.update(self.rates)
+        return out
+
+def formatStats(stats):
+    return ('{:.0f} B/s, {:.1f} frames/s, {} frames total, {} checksum failures, {} dropped partial frames, '
+        '{:.1f} escapes/s, {} invalid types, send queue depth {} (max {}), {} results ({:.0%} duplicates)').format(
+            stats['bytesPerSecond'], stats['framesPerSecond'], stats['framesReceived'], stats['checksumFailures'],
+            stats['droppedFrames'], stats['escapesPerSecond'], stats['invalidTypes'], stats['sendQueueDepth'],
+            stats['maxSendQueueDepth'], stats['uniqueResults'], stats['duplicateRatio']
+        )
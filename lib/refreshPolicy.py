@@ -0,0 +1,27 @@
+from time import monotonic
+
+# Decides when live results are worth processing again. Refreshes happen at most maxRate times a second and only once
+# at least minNewPoints datapoints have arrived since the last one, except for the final refresh once everything has
+# arrived, which always happens. Refreshes are also kept at least loadFactor times as far apart as the last one took to
+# process, so a slow machine refreshes less often instead of falling behind the radio.
+class RefreshPolicy():
+    def __init__(self, maxRate=4, minNewPoints=64, loadFactor=2):
+        self.maxRate = maxRate
+        self.minNewPoints = minNewPoints
+        self.loadFactor = loadFactor
+        self._lastRefresh = None
+
+    def getInterval(self, processingTime=0):
+        return max(1 / self.maxRate, processingTime * self.loadFactor)
+
+    def shouldRefresh(self, newPoints, processingTime=0, complete=False):
+        if newPoints <= 0:
+            return False
+        if complete or self._lastRefresh is None:
+            return True
+        if newPoints < self.minNewPoints:
+            return False
+        return monotonic() - self._lastRefresh >= self.getInterval(processingTime)
+
+    def refreshed(self):
+        self._lastRefresh = monotonic()
@@ -0,0 +1,61 @@
+import numpy as np
+
+# Sequence numbers are 16 bits, so a store that covers all of them never has to grow
+RESULT_CAPACITY = 2 ** 16
+
+# Holds downloaded results in columns indexed by sequence number, along with a mask of which ones have arrived. Results
+# can come in any order and are always in order in the store.
+class ResultStore():
+    def __init__(self, capacity=RESULT_CAPACITY):
+        self.capacity = capacity
+        self.time = np.zeros(capacity, dtype=np.uint16)
+        self.force = np.zeros(capacity, dtype=np.int32)
+        self.pressure = np.zeros(capacity, dtype=np.int32)
+        self.present = np.zeros(capacity, dtype=bool)
+        self.count = 0
+        self.highest = None
+        # The number of datapoints in the recording, once it is known
+        self.size = None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, seqNum):
+        return bool(self.present[seqNum])
+
+    # Returns False if there was already a datapoint with this sequence number
+    def add(self, seqNum, time, force, pressure):
+        if self.present[seqNum]:
+            return False
+        self.time[seqNum] = time
+        self.force[seqNum] = force
+        self.pressure[seqNum] = pressure
+        self.present[seqNum] = True
+        self.count += 1
+        if self.highest is None or seqNum > self.highest:
+            self.highest = seqNum
+        return True
+
+    def setSize(self, size):
+        self.size = size
+
+    # The end of the range of sequence numbers that should be filled, which is the size of the recording if it is known
+    def getEnd(self):
+        if self.size is not None:
+            return self.size
+        return 0 if self.highest is None else self.highest + 1
+
+    def getSeqNums(self):
+        return np.flatnonzero(self.present)
+
+    def getMissing(self):
+        return np.flatnonzero(~self.present[:self.getEnd()])
+
+    # Returns the runs of missing sequence numbers as a list of (start, end) tuples, with the end exclusive
+    def getGaps(self):
+        missing = np.concatenate(([0], (~self.present[:self.getEnd()]).view(np.int8), [0]))
+        edges = np.flatnonzero(np.diff(missing))
+        return [(int(start), int(end)) for start, end in zip(edges[::2], edges[1::2])]
+
+    def isComplete(self):
+        return self.size is not None and bool(self.present[:self.size].all())
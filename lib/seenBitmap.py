@@ -0,0 +1,22 @@
+# Tracks which of a fixed range of indices have been seen, using one bit per index
+class SeenBitmap():
+    def __init__(self, size):
+        self.size = size
+        self._bits = bytearray((size + 7) // 8)
+        self.count = 0
+
+    # Marks the index as seen. Returns True if it hadn't been seen before.
+    def add(self, index):
+        byte, mask = index >> 3, 1 << (index & 7)
+        if self._bits[byte] & mask:
+            return False
+        self._bits[byte] |= mask
+        self.count += 1
+        return True
+
+    def __contains__(self, index):
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+    def clear(self):
+        self._bits = bytearray(len(self._bits))
+        self.count = 0
@@ -0,0 +1,79 @@
+from collections import deque
+from enum import IntEnum
+from threading import Lock
+from time import monotonic
+
+class SEND_PRIORITY(IntEnum):
+    HIGH = 0
+    NORMAL = 1
+
+# Each byte on the wire is a start bit, 8 data bits, and a stop bit
+BITS_PER_BYTE = 10
+# How many bytes can be handed to the port at once after the link has been idle. Keeping this small means the OS
+# buffer never holds a backlog that a higher priority packet would have to wait behind.
+BURST_BYTES = 32
+
+class QueuedFrame():
+    def __init__(self, frame, remaining, priority):
+        self.frame = frame
+        self.remaining = remaining
+        self.priority = priority
+
+# Decides which frame to transmit next, and when, so that transmitting never outpaces the radio link. Sending the
+# same frame again while copies of it are still queued tops up its resend count instead of queueing more copies, and
+# queued frames of equal priority take turns so that one command's resends don't delay the others.
+class SendScheduler():
+    def __init__(self, baudRate):
+        self.bytesPerSecond = baudRate / BITS_PER_BYTE
+        self._lock = Lock()
+        self._queues = {priority: deque() for priority in SEND_PRIORITY}
+        self._queued = {}
+        self._budget = BURST_BYTES
+        self._lastRefill = monotonic()
+
+    def add(self, frame, count, priority=SEND_PRIORITY.NORMAL):
+        if count <= 0:
+            return
+        frame = bytes(frame)
+        with self._lock:
+            if frame in self._queued:
+                queued = self._queued[frame]
+                queued.remaining = max(queued.remaining, count)
+                return
+            queued = QueuedFrame(frame, count, priority)
+            self._queued[frame] = queued
+            self._queues[priority].append(queued)
+
+    def clear(self):
+        with self._lock:
+            for queue in self._queues.values():
+                queue.clear()
+            self._queued = {}
+
+    def pending(self):
+        return len(self._queued)
+
+    # Returns a tuple of the next frame to write (or None) and how long to wait before asking again. The delay is
+    # None when there is nothing queued.
+    def nextFrame(self):
+        with self._lock:
+            queue = next((queue for queue in self._queues.values() if len(queue) > 0), None)
+            if queue is None:
+                return None, None
+            self._refill()
+            queued = queue[0]
+            if self._budget < len(queued.frame):
+                return None, (len(queued.frame) - self._budget) / self.bytesPerSecond
+            self._budget -= len(queued.frame)
+            queue.popleft()
+            queued.remaining -= 1
+            if queued.remaining > 0:
+                queue.append(queued)
+            else:
+                del self._queued[queued.frame]
+            return queued.frame, 0
+
+    def _refill(self):
+        now = monotonic()
+        self._budget = min(BURST_BYTES, self._budget + (now - self._lastRefill) * self.bytesPerSecond)
+        self._lastRefill = now
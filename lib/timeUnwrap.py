@@ -0,0 +1,20 @@
+import numpy as np
+
+# Times recorded by the board are 16 bit millisecond counts, so they roll over about every 65 seconds
+TIME_ROLLOVER = 2 ** 16
+
+# Returns an array of the times with the rollovers undone. Time only moves forward, so every step backwards is taken to
+# be a rollover.
+def unwrapTime(times):
+    times = np.asarray(times, dtype=np.int64)
+    rollovers = np.zeros(len(times), dtype=np.int64)
+    np.cumsum(np.diff(times) < 0, out=rollovers[1:])
+    return times + rollovers * TIME_ROLLOVER
+
+# Unwraps a single time, given the raw and unwrapped times of the datapoint before it, for data that arrives a point
+# at a time. Applying it to each point in turn gives the same result as unwrapTime.
+def unwrapNext(previousRaw, previousUnwrapped, raw):
+    unwrapped = raw + previousUnwrapped - previousRaw
+    if raw < previousRaw:
+        unwrapped += TIME_ROLLOVER
+    return unwrapped
@@ -0,0 +1,213 @@
+import io
+import socket
+import time
+
+import serial
+
+from .capture import CaptureReader, CAPTURE_DIRECTION, isCaptureFile
+
+# Ports that start with these prefixes are opened as something other than a serial port
+TCP_PREFIX = 'tcp://'
+REPLAY_PREFIX = 'replay://'
+# Replays of capture files can have a speed multiplier appended, such as "replay://session.cap?speed=10". A speed of 0
+# plays the capture back as fast as possible.
+SPEED_SUFFIX = '?speed='
+
+# How long to wait for a TCP connection to be accepted
+CONNECT_TIMEOUT = 5
+# How often to check for data on transports that can't be waited on with select
+POLL_INTERVAL = 0.01
+
+# Byte streams that the radio manager can run the radio protocol over. Transports are serviced by the radio loop, so
+# reads never block.
+class Transport():
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    # Returns the bytes that are waiting, which may be none. Returns None once the stream has ended.
+    def read(self):
+        raise NotImplementedError()
+
+    def write(self, data):
+        raise NotImplementedError()
+
+    # Returns a file descriptor that select can wait on for data to arrive, or None if that isn't possible
+    def fileno(self):
+        return None
+
+    # Returns how long the loop can wait before it has to call read again, or None if it can wait until fileno is
+    # readable
+    def pollDelay(self):
+        return None
+
+class SerialTransport(Transport):
+    def __init__(self, port, baudRate):
+        self.port = port
+        self.baudRate = baudRate
+        self.serial = None
+
+    def open(self):
+        self.serial = serial.Serial(self.port, self.baudRate, timeout=0)
+
+    def close(self):
+        self.serial.close()
+
+    def read(self):
+        return self.serial.read(self.serial.in_waiting)
+
+    def write(self, data):
+        self.serial.write(data)
+
+    def fileno(self):
+        # Serial ports are only selectable on posix systems. Elsewhere pyserial still has the fileno inherited from
+        # io.RawIOBase, but it raises.
+        try:
+            return self.serial.fileno()
+        except (AttributeError, io.UnsupportedOperation, OSError):
+            return None
+
+    def pollDelay(self):
+        return POLL_INTERVAL if self.fileno() is None else None
+
+    def __str__(self):
+        return 'serial port {} at {} baud'.format(self.port, self.baudRate)
+
+# For radios attached to a networked serial bridge
+class TcpTransport(Transport):
+    RECV_SIZE = 4096
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.socket = None
+
+    def open(self):
+        self.socket = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        self.socket.setblocking(False)
+
+    def close(self):
+        self.socket.close()
+
+    def read(self):
+        try:
+            data = self.socket.recv(self.RECV_SIZE)
+        except BlockingIOError:
+            return b''
+        if len(data) == 0:
+            return None
+        return data
+
+    def write(self, data):
+        # Packets are small and paced to the radio link, so waiting for room in the socket buffer is rare and short
+        self.socket.setblocking(True)
+        try:
+            self.socket.sendall(data)
+        finally:
+            self.socket.setblocking(False)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def __str__(self):
+        return 'TCP connection to {}:{}'.format(self.host, self.port)
+
+# Plays back a file of bytes received from a radio as fast as they can be read. Anything sent is discarded.
+class ReplayTransport(Transport):
+    CHUNK_SIZE = 4096
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def open(self):
+        self.file = open(self.path, 'rb')
+
+    def close(self):
+        self.file.close()
+
+    def read(self):
+        data = self.file.read(self.CHUNK_SIZE)
+        if len(data) == 0:
+            return None
+        return data
+
+    def write(self, data):
+        pass
+
+    def pollDelay(self):
+        return 0
+
+    def __str__(self):
+        return 'replay of {}'.format(self.path)
+
+# Plays back the received side of a capture file with the original timing, sped up by a factor of speed. Anything
+# sent is discarded.
+class CaptureReplayTransport(Transport):
+    def __init__(self, path, speed):
+        self.path = path
+        self.speed = speed
+        self.reader = None
+        self._record = None
+        self._replayStart = None
+
+    def open(self):
+        self.reader = CaptureReader(self.path)
+
+    def close(self):
+        self.reader.close()
+
+    def read(self):
+        if self._record is None:
+            self._record = self._nextReceivedRecord()
+            if self._record is None:
+                return None
+        if self.pollDelay() > 0:
+            return b''
+        data = self._record[1]
+        self._record = None
+        return data
+
+    # The time until the next record is due to be played back
+    def pollDelay(self):
+        if self._record is None or self.speed == 0:
+            return 0
+        timestamp = self._record[0]
+        if self._replayStart is None:
+            self._replayStart = time.monotonic() - (timestamp / self.speed)
+        return max(0, self._replayStart + (timestamp / self.speed) - time.monotonic())
+
+    def _nextReceivedRecord(self):
+        while True:
+            record = self.reader.readRecord()
+            if record is None:
+                return None
+            timestamp, direction, data = record
+            if direction == CAPTURE_DIRECTION.RECEIVED:
+                return timestamp, data
+
+    def write(self, data):
+        pass
+
+    def __str__(self):
+        speed = 'as fast as possible' if self.speed == 0 else 'at {}x speed'.format(self.speed)
+        return 'replay of capture {} {}'.format(self.path, speed)
+
+# Picks the transport for a port. Ports like "tcp://host:port" connect to a serial bridge, "replay://path" plays back
+# a capture or a raw file of received bytes, and anything else is treated as the name of a serial port.
+def createTransport(port, baudRate):
+    if port.startswith(TCP_PREFIX):
+        host, portNumber = port[len(TCP_PREFIX):].rsplit(':', 1)
+        return TcpTransport(host, int(portNumber))
+    if port.startswith(REPLAY_PREFIX):
+        path = port[len(REPLAY_PREFIX):]
+        speed = 1
+        if SPEED_SUFFIX in path:
+            path, speed = path.rsplit(SPEED_SUFFIX, 1)
+            speed = float(speed)
+        if isCaptureFile(path):
+            return CaptureReplayTransport(path, speed)
+        return ReplayTransport(path)
+    return SerialTransport(port, baudRate)
@@ -0,0 +1,19 @@
+import lib.downloadProgress
+from lib.downloadProgress import DownloadProgress
+from lib.resultStore import ResultStore
+
+# Results handled together can get the same time from a coarse clock, which leaves the send rate unknown
+def testEqualTimestamps(monkeypatch):
+    monkeypatch.setattr(lib.downloadProgress, 'monotonic', lambda: 100.0)
+    results = ResultStore()
+    progress = DownloadProgress(results, 10)
+    for seqNum in (0, 10, 20):
+        results.add(seqNum, seqNum * 7, 0, 0)
+        if seqNum == 0:
+            results.setSize(128)
+        progress.addResult(seqNum)
+    assert progress.getSendRate() is None
+    assert progress.getDeliveryRatio() is None
+    snapshot = progress.snapshot()
+    assert snapshot['deliveryRatio'] is None
+    assert snapshot['timeRemaining'] is None
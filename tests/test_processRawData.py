@@ -0,0 +1,90 @@
+import json
+import math
+import os
+import random
+
+import numpy as np
+import pytest
+
+from lib.converter import Converter
+from lib.motor import processRawData, MotorConfig, IncrementalProcessor, DESPIKE_METHODS
+from lib.resultStore import ResultStore
+
+# The output of processRawData for each generated recording below, saved from the list based implementation it replaced
+GOLDEN_PATH = os.path.join(os.path.dirname(__file__), 'golden', 'processRawData.json')
+
+with open(GOLDEN_PATH) as goldenFile:
+    GOLDEN = json.load(goldenFile)
+
+# Builds a recording of a firing along with converters and a motor config, all picked from the seed. Some have spikes,
+# runs of spikes that cascade through the outlier rejection, channels of pure noise or times that roll over when they
+# are sent by the board.
+def getRecording(seed):
+    rand = random.Random(seed)
+    numPoints = rand.choice([64, 128, 256, 512, 1024])
+    burnTime = rand.choice([500, 1500, 3000])
+    rawData = {'time': [], 'force': [], 'pressure': []}
+    currentTime = 0
+    for i in range(numPoints):
+        currentTime += rand.choice((6, 7))
+        burnFraction = (currentTime - 400) / burnTime
+        level = math.sin(math.pi * burnFraction) ** 0.5 if 0 < burnFraction < 1 else 0
+        rawData['time'].append(currentTime)
+        rawData['force'].append(0x10000 + int(level * 0x300000) + rand.randrange(-300, 300))
+        rawData['pressure'].append(0x10000 + int(level * 0x200000) + rand.randrange(-300, 300))
+    for i in range(rand.randrange(0, 30)):
+        start = rand.randrange(numPoints)
+        for index in range(start, min(start + rand.choice([1, 1, 2, 3]), numPoints)):
+            rawData['force'][index] = rawData['force'][index] * rand.choice([3, 5, 9]) + rand.randrange(1000)
+            rawData['pressure'][index] = rawData['pressure'][index] * rand.choice([3, 5]) + 7
+    if seed % 5 == 0:
+        rawData['force'] = [rand.randrange(0, 2 ** 24) for _ in range(numPoints)]
+    if seed % 7 == 0:
+        for index in range(min(100, numPoints - 60), min(160, numPoints)):
+            rawData['force'][index] = 1 if index % 2 else 3 ** (index % 5)
+    if seed % 11 == 3:
+        rawData['time'] = [time + 65000 for time in rawData['time']]
+
+    forceConv = Converter({'name': 'Force', 'type': 'Load Cell', 'ratio': rand.choice([0.001, -0.0007, 0.0123]),
+        'offset': rand.uniform(-5000, 5000)})
+    pressureConv = Converter({'name': 'Pressure', 'type': 'Pressure Transducer', 'ratio': rand.choice([0.05, 1.7]),
+        'offset': rand.uniform(-1e5, 1e5)})
+    forceConv, pressureConv = [(forceConv, pressureConv), (forceConv, None), (None, pressureConv)][seed % 3]
+    motorInfo = MotorConfig({
+        'motorOrientation': rand.choice(['Vertical', 'Horizontal']),
+        'propellantMass': rand.uniform(0.1, 5),
+        'throatDiameter': 0.01,
+        'cutoffThreshold': rand.choice([1, 5, 20])
+    })
+    return rawData, forceConv, pressureConv, motorInfo
+
+# Processing gives exactly the same results as it did before
+@pytest.mark.parametrize('seed', sorted(GOLDEN, key=int))
+def testGoldenOutput(seed):
+    rawData, forceConv, pressureConv, motorInfo = getRecording(int(seed))
+    expected = GOLDEN[seed]
+    results = processRawData(rawData, forceConv, pressureConv, motorInfo)
+    assert np.array_equal(results.time, expected['time'])
+    assert np.array_equal(results.force, expected['force'])
+    assert np.array_equal(results.pressure, expected['pressure'])
+    assert results.startupTime == expected['startupTime']
+
+# Processing results as they arrive gives exactly the same results as processing them all at once, whatever order they
+# came in and with every spike filter
+@pytest.mark.parametrize('despikeMethod', DESPIKE_METHODS)
+@pytest.mark.parametrize('seed', [3, 4, 5, 12])
+def testIncrementalMatchesBatch(seed, despikeMethod):
+    rawData, forceConv, pressureConv, motorInfo = getRecording(seed)
+    motorInfo.setProperties({'despikeMethod': despikeMethod})
+    rawTimes = [time & 0xFFFF for time in rawData['time']]
+    processor = IncrementalProcessor(ResultStore(), forceConv, pressureConv, motorInfo)
+    order = list(range(len(rawTimes)))
+    random.Random(seed).shuffle(order)
+    for seqNum in order:
+        processor.add(seqNum, rawTimes[seqNum], rawData['force'][seqNum], rawData['pressure'][seqNum])
+    incremental = processor.process()
+    batch = processRawData(rawData, forceConv, pressureConv, motorInfo)
+    assert np.array_equal(incremental.time, batch.time)
+    assert np.array_equal(incremental.force, batch.force)
+    assert np.array_equal(incremental.pressure, batch.pressure)
+    assert incremental.startupTime == batch.startupTime
@@ -148,6 +148,7 @@ class FireWidget(QWidget):
         self.firing.newFiringPacket.connect(self.newFiringPacket)
         self.firing.fullSizeKnown.connect(self.gotoResults)
         self.firing.newResultsPacket.connect(QApplication.instance().newResultsPacket)
+        self.firing.downloadProgress.connect(QApplication.instance().downloadProgress)
         self.firing.newGraph.connect(QApplication.instance().newResult)
         self.firing.stopped.connect(lambda: self.toggleFields(self.resultsFields, True))
         self.firing.initialResultsTime.connect(self.initialResultsTime)
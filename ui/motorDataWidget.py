@@ -5,6 +5,7 @@ from PyQt6.QtCore import pyqtSignal
 from ui.views.MotorDataWidget_ui import Ui_MotorDataWidget
 from lib.motor import MotorConfig, processRawData
 from lib.logger import logger
+from lib.timeUnwrap import unwrapTime
 from traceback import format_exc
 
 class MotorDataWidget(QWidget):
@@ -23,7 +24,6 @@ class MotorDataWidget(QWidget):
     def setup(self, data):
         self.raw = {'time': [], 'force': [], 'pressure': []}
         rawFrames = []
-        minTime = 0
 
         # Cut the data up into frames of the correct size
         for start in range(0, len(data), 16):
@@ -31,14 +31,11 @@ class MotorDataWidget(QWidget):
         logger.log('Frames: {}'.format(len(rawFrames)))
         # Separate the frames into time, force, and pressure
         for frame in rawFrames:
-            # Account for (16 bit) time looping around
-            t = minTime + int(frame[0:2], 16) + (256 * int(frame[2:4], 16))
-            if len(self.raw['time']) > 0 and t < self.raw['time'][-1]:
-                minTime += 2 ** 16
-                t += 2 ** 16
-            self.raw['time'].append(t)
+            self.raw['time'].append(int(frame[0:2], 16) + (256 * int(frame[2:4], 16)))
             self.raw['force'].append(int(frame[4:6], 16) + (int(frame[6:8], 16) << 8) + (int(frame[8:10], 16) << 16))
             self.raw['pressure'].append(int(frame[10:12], 16) + (int(frame[12:14], 16) << 8) + (int(frame[14:16], 16) << 16))
+        # Account for (16 bit) time looping around
+        self.raw['time'] = unwrapTime(self.raw['time']).tolist()
 
         self.ui.widgetTransducerSelector.reset()
         self.ui.motorData.setPreferences(QApplication.instance().getPreferences())
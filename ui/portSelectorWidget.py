@@ -10,6 +10,8 @@ class PortSelectorWidget(QWidget):
         self.ui = Ui_PortSelectorWidget()
         self.ui.setupUi(self)
 
+        # Editable so that network bridges (tcp://host:port) and replays (replay://path) can be typed in
+        self.ui.comboBoxPort.setEditable(True)
         self.ui.pushButtonRefresh.pressed.connect(self.refreshPorts)
         self.refreshPorts()
 
@@ -55,6 +55,7 @@ class RecvResultsWidget(QWidget):
         self.firing.newGraph.connect(QApplication.instance().newResult)
         self.firing.fullSizeKnown.connect(self.gotoResults)
         self.firing.newResultsPacket.connect(QApplication.instance().newResultsPacket)
+        self.firing.downloadProgress.connect(QApplication.instance().downloadProgress)
         self.firing.initialResultsTime.connect(self.initialResultsTime)
 
     def initialResultsTime(self, time):
@@ -68,6 +68,7 @@ class ResultsWidget(QWidget):
         self.ui.groupBoxRecvResults.setVisible(True)
         self.ui.progressBarReceived.setMaximum(firingLength)
         self.ui.progressBarReceived.setValue(0)
+        self.ui.progressBarReceived.resetFormat()
         self.ui.widgetDataAge.start()
 
     def regraphData(self):
@@ -121,15 +122,24 @@ class ResultsWidget(QWidget):
             self.ui.labelFileName.setText(fileName)
         self.ui.labelRecordingDuration.setText(app.convertToUserAndFormat(max(motorData.getRawTime()) / 1000, 's', 3))
 
-        if self.liveMode:
-            self.ui.progressBarReceived.setValue(len(motorData.getRawTime()))
-
         self.motorData = motorData
         self.regraphData()
 
     def newResultsPacket(self):
         self.ui.widgetDataAge.reset()
 
+    def downloadProgress(self, progress):
+        if progress['size'] is not None:
+            self.ui.progressBarReceived.setMaximum(progress['size'])
+        self.ui.progressBarReceived.setValue(min(progress['received'], self.ui.progressBarReceived.maximum()))
+        if progress['missing'] is None or progress['missing'] == 0:
+            self.ui.progressBarReceived.resetFormat()
+            return
+        timeRemaining = progress['timeRemaining']
+        remaining = '?' if timeRemaining is None else '{:.0f} s'.format(timeRemaining)
+        self.ui.progressBarReceived.setFormat('%p% - {} missing in {} gaps, about {} left'.format(
+            progress['missing'], len(progress['gaps']), remaining))
+
     def saveFIRE(self):
         path = QFileDialog.getSaveFileName(None, 'Save FIRE', '', 'Firing Data File (*.fire)')[0]
         if path is None or path == '':
@@ -151,11 +161,10 @@ class ResultsWidget(QWidget):
             return
         if not path.endswith('.csv'):
             path += '.csv'
-        data = self.motorData.getCSV()
         logger.log('Saving CSV to {}'.format(path))
         try:
             with open(path, 'w') as outFile:
-                outFile.write(data)
+                self.motorData.writeCSV(outFile)
         except Exception as err:
             logger.log('Failed to save firing data, err: {}'.format(repr(err)))
             QApplication.instance().outputException(err, 'Error saving file:')
@@ -166,11 +175,10 @@ class ResultsWidget(QWidget):
             return
         if not path.endswith('.csv'):
             path += '.csv'
-        data = self.motorData.getRawCSV()
         logger.log('Saving raw CSV to {}'.format(path))
         try:
             with open(path, 'w') as outFile:
-                outFile.write(data)
+                self.motorData.writeRawCSV(outFile)
         except Exception as err:
             logger.log('Failed to save firing data, err: {}'.format(repr(err)))
             QApplication.instance().outputException(err, 'Error saving file:')